@@ -1,16 +1,15 @@
 import pickle
-import time
 import sys
 import logging
-import project_db
+import base_scraper
+from base_scraper import BaseScraper
+from diagnostics import DIAGNOSTICS
+from dom_extract import extract_fields, missing_fields
+from metrics import timed
 from dataclasses import dataclass
 from typing import Optional
-from selenium import webdriver
-from selenium.common import NoSuchElementException
 from selenium.webdriver.common.by import By
-from selenium.webdriver.support.wait import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.chrome.options import Options
 
 AUTOSCOUT24_URL = "https://www.autoscout24.com/lst?atype=C&cy=D%2CA%2CB%2CE%2CF%2CI%2CL%2CNL&damaged_listing=exclude&desc=1&powertype=kw&search_id=1wuxwwg2mq5&sort=age&source=homepage_search-mask&ustate=N%2CU"
 
@@ -36,58 +35,65 @@ class CarData:
     gearbox: str
     mileage: str
 
-class Autoscout24Scraper:
-    def __init__(self, url: str, cookies_file: str):
-        self.url = url
-        self.cookies_file = cookies_file
-        self.driver = None
-        self.base_window = None
-
-    def setup_driver(self):
-        options = Options()
-        options.add_argument("--headless")
-        options.add_argument("--disable-gpu")
-        options.add_argument("window-size=1920,4080")
-        self.driver = webdriver.Chrome(options = options)
-        self.driver.get(self.url)
-        self.handle_cookies()
-
-        try:
-            selectors = [
-                (By.CLASS_NAME, 'sc-btn-primary'),
-                (By.CLASS_NAME, 'privacy-consent-accept'),
-                (By.CSS_SELECTOR, '[data-testid="consent-button"]'),
-                (By.XPATH, '//button[contains(text(), "Accept All")]'),
-            ]
-
-            for by, selector in selectors:
-                try:
-                    cookie_button = WebDriverWait(self.driver, 5).until(
-                        EC.element_to_be_clickable((by, selector))
-                    )
-                    cookie_button.click()
-                    break
-                except:
-                    continue
-
-            self.load_cookies()
-            self.driver.refresh()
-            self.base_window = self.driver.window_handles[0]
-
-        except Exception as e:
-            logger.info(f"Error handling cookies: {e}")
-            self.driver.quit()
-            raise
-
+OVERVIEW_ITEM_XPATH = "(//div[contains(@class, 'StageArea_overviewContainer__UyZ9n')]//div[contains(@class,'VehicleOverview_itemText__AI4dA')])[{}]"
+
+# Detail page fields, shared by the browser and the http extraction engines
+FIELDS = {
+    'brand': "//*[contains(@class, 'StageTitle_makeModelContainer__RyjBP')]",
+    'model_ver': "//*[contains(@class, 'StageTitle_modelVersion__Yof2Z')]",
+    'price': "//*[contains(@class, 'PriceInfo_price__XU0aF')]",
+    'mileage': OVERVIEW_ITEM_XPATH.format(1),
+    'gearbox': OVERVIEW_ITEM_XPATH.format(2),
+    'year': OVERVIEW_ITEM_XPATH.format(3),
+    'fuel': OVERVIEW_ITEM_XPATH.format(4),
+    'engine_power': OVERVIEW_ITEM_XPATH.format(5),
+    'location': "//*[@id='vendor-and-cta-section']//*[starts-with(@class,'Department_departmentContainer')]/a",
+}
+REQUIRED_FIELDS = ('brand', 'price')
+
+
+def parse_price(price_text: str) -> int:
+    if len(price_text) > 8:
+        price_text = price_text[:-1]
+    return int(price_text.strip('€').replace(' ', '').replace(',', ''))
+
+
+def build_car_data(url: str, values: dict) -> CarData:
+    """Builds CarData from raw field texts keyed like FIELDS, missing fields are None"""
+    return CarData(
+        url=url,
+        brand=values['brand'],
+        model_ver=values.get('model_ver'),
+        price=parse_price(values['price']),
+        year=values.get('year'),
+        location=values.get('location'),
+        fuel=values.get('fuel'),
+        engine_power=values.get('engine_power'),
+        gearbox=values.get('gearbox'),
+        mileage=values.get('mileage')
+    )
+
+
+class Autoscout24Scraper(BaseScraper):
+    webpage_name = 'autoscout24'
+    domain = 'autoscout24.com'
+    site_module = __name__
+    listing_ready = (By.CSS_SELECTOR, 'article')
+    detail_ready = (By.XPATH, FIELDS['price'])
+    window_size = '1920,4080'
+
+    @timed('handle_cookies')
     def handle_cookies(self):
         if not self.load_cookies():
             try:
                 if 'consent' in self.driver.current_url.lower():
-                    necessary_button = WebDriverWait(self.driver, 10).until(
-                        EC.element_to_be_clickable((By.CLASS_NAME, 'scr-button scr-button--secondary'))
+                    necessary_button = self.readiness.wait(
+                        self.driver, EC.element_to_be_clickable((By.CSS_SELECTOR, '.scr-button.scr-button--secondary')),
+                        'consent', timeout=10
                     )
                     necessary_button.click()
-                    time.sleep(2)
+                    self.readiness.wait(self.driver, lambda d: 'consent' not in d.current_url.lower(),
+                                        'consent_redirect', timeout=5)
                     self.save_cookies()
             except Exception as e:
                 logger.info(f"Error handling cookie consent: {e}")
@@ -104,158 +110,31 @@ class Autoscout24Scraper:
             logger.info("Cookies file not found. Proceeding without loading cookies.")
             return False
 
-    def save_cookies(self):
-        cookies = self.driver.get_cookies()
-        with open(self.cookies_file, 'wb') as file:
-            pickle.dump(cookies, file)
-
+    @timed('extract_car_data')
     def extract_car_data(self) -> Optional[CarData]:
         try:
-            wait = WebDriverWait(self.driver, 20)
-            brand = wait.until(EC.presence_of_element_located(
-                (By.CLASS_NAME, 'StageTitle_makeModelContainer__RyjBP'))).text
-            model_ver = self.driver.find_element(By.CLASS_NAME, 'StageTitle_modelVersion__Yof2Z').text
-            price_text = self.driver.find_element(By.CLASS_NAME, 'PriceInfo_price__XU0aF').text
-            if len(price_text) > 8:
-                price_text = price_text[:-1]
-            price = int(price_text.strip('€').replace(' ', '').replace(',', ''))
-
-            try:
-                year = self.driver.find_element(By.XPATH, "(//div[contains(@class, 'StageArea_overviewContainer__UyZ9n')]//div[contains(@class,'VehicleOverview_itemText__AI4dA')])[3]").text
-            except NoSuchElementException as e:
-                logger.exception(self.driver.page_source.encode('utf-8'))
-                self.driver.save_screenshot('screen.png')
-                year = None
-
-            try:
-                location_element = self.driver.find_element(By.XPATH,"//*[@id='vendor-and-cta-section']//*[starts-with(@class,'Department_departmentContainer')]/a")
-            except NoSuchElementException:
-                location_element = None
-                logger.exception(self.driver.page_source.encode('utf-8'))
-                self.driver.save_screenshot('location_screen.png')
-
-            if location_element is not None:
-                location = location_element.text
-            else:
-                location = None
-
-            try:
-                fuel = self.driver.find_element(By.XPATH, "(//div[contains(@class, 'StageArea_overviewContainer__UyZ9n')]//div[contains(@class,'VehicleOverview_itemText__AI4dA')])[4]").text
-            except NoSuchElementException:
-                fuel = None
+            self.readiness.element(self.driver, (By.XPATH, FIELDS['brand']), 'detail_title')
+            result = extract_fields(self.driver, FIELDS, site=self.webpage_name)
+            if self.snapshots:
+                self.snapshots.save(result['url'], self.webpage_name, self.driver.page_source)
 
-            try:
-                engine_power = self.driver.find_element(By.XPATH, "(//div[contains(@class, 'StageArea_overviewContainer__UyZ9n')]//div[contains(@class,'VehicleOverview_itemText__AI4dA')])[5]").text
-            except NoSuchElementException as e:
-                logger.exception(self.driver.page_source.encode('utf-8'))
-                self.driver.save_screenshot('screen.png')
-                engine_power = None
-
-            try:
-                gearbox = self.driver.find_element(By.XPATH, "(//div[contains(@class, 'StageArea_overviewContainer__UyZ9n')]//div[contains(@class,'VehicleOverview_itemText__AI4dA')])[2]").text
-            except NoSuchElementException as e:
-                logger.exception(self.driver.page_source.encode('utf-8'))
-                self.driver.save_screenshot('screen.png')
-                gearbox = None
-
-            try:
-                mileage = self.driver.find_element(By.XPATH, "(//div[contains(@class, 'StageArea_overviewContainer__UyZ9n')]//div[contains(@class,'VehicleOverview_itemText__AI4dA')])[1]").text
-            except NoSuchElementException as e:
-                logger.exception(self.driver.page_source.encode('utf-8'))
-                self.driver.save_screenshot('screen.png')
-                mileage = None
+            missing = missing_fields(result, ('year', 'location', 'engine_power', 'gearbox', 'mileage'))
+            if missing:
+                logger.error(f"Missing fields {missing} on {result['url']}")
+                DIAGNOSTICS.report(self.webpage_name, result['url'], missing, FIELDS, driver=self.driver)
 
-            return CarData(
-                url=self.driver.current_url,
-                brand=brand,
-                model_ver=model_ver,
-                price=price,
-                year=year,
-                location=location,
-                fuel=fuel,
-                engine_power=engine_power,
-                gearbox=gearbox,
-                mileage=mileage
-            )
+            return build_car_data(result['url'], result['values'])
         except Exception as e:
             logger.info(f"Error extracting car data: {e}")
             return None
 
-    def scrape(self):
-        self.setup_driver()
-        self.base_window = self.driver.current_window_handle
-
-        items = WebDriverWait(self.driver, 10).until(
-            EC.presence_of_all_elements_located((By.CSS_SELECTOR, 'article'))
-        )
-        links = []
-        for item in items:
-            try:
-                link = item.find_element(By.CSS_SELECTOR, 'a').get_attribute('href')
-                links.append(link)
-            except NoSuchElementException:
-                continue
-
-        batch_size = 5
-        for i in range(0, len(links), batch_size):
-            batch = links[i:i + batch_size]
-            self.process_batch(batch)
-
-        self.driver.quit()
+    def worker_kwargs(self) -> dict:
+        return dict(super().worker_kwargs(), cookies_file=self.cookies_file)
 
-    def process_batch(self, batch):
-        # Open new tabs for each link
-        for link in batch:
-            self.driver.execute_script("window.open('{}');".format(link))
-            time.sleep(0.5)
-
-        # Get all windows except the main window
-        window_handles = self.driver.window_handles[1:]  # Skip the main/first window
-
-        # Process each window
-        for window in window_handles:
-            # Switch to the specific window
-            self.driver.switch_to.window(window)
-
-            # Wait for page to load completely
-            WebDriverWait(self.driver, 30).until(
-                lambda x: x.execute_script("return document.readyState") == "complete"
-            )
-
-            # Check if we're on the correct site
-            if 'autoscout24.com' not in self.driver.current_url:
-                logger.info("Not an autoscout24 page, closing tab.")
-                self.driver.close()
-                continue
-
-            # Extract and process car data
-            car_data = self.extract_car_data()
-            if car_data:
-                logger.info(car_data)
-                project_db.add_to_db(
-                    url=car_data.url,
-                    webpage_name='autoscout24',
-                    brand=car_data.brand,
-                    model_version=car_data.model_ver,
-                    year=car_data.year,
-                    price=car_data.price,
-                    mileage=car_data.mileage,
-                    gearbox=car_data.gearbox,
-                    fuel_type=car_data.fuel,
-                    engine_power=car_data.engine_power,
-                    location=car_data.location
-                )
-
-            # Close the current window
-            self.driver.close()
-
-        # Return to the main window
-        self.driver.switch_to.window(self.base_window)
 
 def main():
-    scraper = Autoscout24Scraper(AUTOSCOUT24_URL, 'autoscout24_cookies.pkl')
-    scraper.scrape()
+    base_scraper.main(Autoscout24Scraper, AUTOSCOUT24_URL, 'autoscout24_cookies.pkl')
+
 
 if __name__ == '__main__':
-    print(logger.handlers)
-    main()
\ No newline at end of file
+    main()
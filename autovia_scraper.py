@@ -1,22 +1,22 @@
 import logging
-import time
 import sys
 import pickle
 from dataclasses import dataclass
 from typing import Optional
-from selenium import webdriver
-from selenium.common import NoSuchElementException
 from selenium.webdriver.common.by import By
-from selenium.webdriver.support.wait import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.chrome.options import Options
 
-import project_db
+import base_scraper
+from base_scraper import BaseScraper
+from diagnostics import DIAGNOSTICS
+from dom_extract import extract_fields, missing_fields
+from metrics import timed
+from rate_limit import RateLimiter
+from url_index import SeenUrlIndex
 
 AUTOVIA_URL = "https://www.autovia.sk/osobne-auta/?p%5Border%5D=1"
 AUTOVIA_COOKIES_FILE = 'cookies/autovia.pkl'
 
-BATCH_SIZE = 5
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
@@ -39,58 +39,85 @@ class CarData:
     gearbox: str
     mileage: str
 
-class AutoviaScraper:
-    def __init__(self, url: str):
-        self.url = url
-        self.cookies_file = AUTOVIA_COOKIES_FILE
-        self.driver = None
-        self.base_window = None
-
-    def setup_driver(self):
-        options = Options()
-        options.add_argument("--headless")
-        options.add_argument("--disable-gpu")
-        options.add_argument("window-size=1920,1080")
-        self.driver = webdriver.Chrome(options = options)
-        self.driver.get(self.url)
-        self.handle_cookies()
-
-        try:
-            selectors = [
-                (By.CLASS_NAME, 'sc-btn-primary'),
-                (By.CLASS_NAME, 'privacy-consent-accept'),
-                (By.CSS_SELECTOR, '[data-testid="consent-button"]'),
-                (By.XPATH, '//button[contains(text(), "Accept All")]'),
-            ]
-
-            for by, selector in selectors:
-                try:
-                    cookie_button = WebDriverWait(self.driver, 5).until(
-                        EC.element_to_be_clickable((by, selector))
-                    )
-                    cookie_button.click()
-                    break
-                except:
-                    continue
-
-            self.load_cookies()
-            self.driver.refresh()
-            self.base_window = self.driver.window_handles[0]
-        except Exception as e:
-            logger.error(f"Error setting up driver: {e}")
-            self.driver.quit()
-            raise
-
+# Detail page fields, shared by the browser and the http extraction engines
+FIELDS = {
+    'brand': '/html/body/main/div[2]/div[1]/div/h1',
+    'price': "//*[contains(concat(' ', normalize-space(@class), ' '), ' resp-price-main ')]",
+    'year': "//strong[contains(text(),'Rok:')]/parent::div",
+    'location': "//div[@title='Lokalita']",
+    'fuel': "//strong[contains(text(), 'Palivo:')]/parent::div",
+    'engine_power': "//strong[contains(text(),'Výkon motora:')]/parent::div",
+    'gearbox': "//strong[contains(text(),'Prevodovka:')]/parent::div",
+    'mileage': "//strong[contains(text(), 'Počet km:')]/parent::div",
+}
+REQUIRED_FIELDS = ('brand', 'price', 'year', 'location', 'fuel', 'engine_power', 'gearbox', 'mileage')
+
+# Labels preceding the values in the field texts
+FIELD_LABELS = {
+    'year': 'Rok:',
+    'location': 'Lokalita',
+    'fuel': 'Palivo:',
+    'engine_power': 'Výkon motora:',
+    'gearbox': 'Prevodovka:',
+    'mileage': 'Počet km:',
+}
+
+
+def parse_price(price_text: str) -> int:
+    return int(price_text.strip('€').replace(',', '').replace(' ', ''))
+
+
+def strip_label(field: str, text: Optional[str]) -> Optional[str]:
+    label = FIELD_LABELS.get(field)
+    if text is None or label is None:
+        return text
+    return text.replace(label, '', 1).strip()
+
+
+def build_car_data(url: str, values: dict) -> CarData:
+    """Builds CarData from raw field texts keyed like FIELDS"""
+    return CarData(
+        url=url,
+        brand=values['brand'],
+        model_ver=None,
+        price=parse_price(values['price']),
+        year=strip_label('year', values['year']),
+        location=strip_label('location', values['location']),
+        fuel=strip_label('fuel', values['fuel']),
+        engine_power=strip_label('engine_power', values['engine_power']),
+        gearbox=strip_label('gearbox', values['gearbox']),
+        mileage=strip_label('mileage', values['mileage'])
+    )
+
+
+class AutoviaScraper(BaseScraper):
+    webpage_name = 'autovia'
+    domain = 'autovia'
+    site_module = __name__
+    listing_ready = (By.CSS_SELECTOR, 'section.resp-search-results div.resp-item')
+    detail_ready = (By.XPATH, FIELDS['price'])
+    window_size = '1920,1080'
+    # Hosts the lean profile must never block
+    lean_allowlist = ('privacy-mgmt.com',)
+    page_param = 'p%5Bpage%5D'
+
+    def __init__(self, url: str, url_index: Optional[SeenUrlIndex] = None, snapshot_dir: Optional[str] = None,
+                 profile: str = 'full', allowlist: tuple = (), session_dir: Optional[str] = None,
+                 rate_limiter: Optional[RateLimiter] = None, recycle_pages: Optional[int] = 500,
+                 recycle_rss_mb: Optional[float] = 1500):
+        super().__init__(url, AUTOVIA_COOKIES_FILE, url_index, snapshot_dir, profile, allowlist, session_dir,
+                         rate_limiter, recycle_pages, recycle_rss_mb)
+
+    @timed('handle_cookies')
     def handle_cookies(self):
         if not self.load_cookies():
             try:
-                iframe = WebDriverWait(self.driver, 10).until(
-                    EC.presence_of_element_located((By.CSS_SELECTOR, 'iframe'))
-                )
+                self.readiness.element(self.driver, (By.CSS_SELECTOR, 'iframe'), 'consent_iframe', timeout=10)
                 self.driver.switch_to.frame('sp_message_iframe_1235490')
-                settings_btn = WebDriverWait(self.driver, 2).until(
-                     EC.element_to_be_clickable((By.XPATH, '//*[@id="notice"]/div[2]/button'))
-                 )
+                settings_btn = self.readiness.wait(
+                    self.driver, EC.element_to_be_clickable((By.XPATH, '//*[@id="notice"]/div[2]/button')),
+                    'consent', timeout=2
+                )
                 settings_btn.click()
                 self.driver.switch_to.default_content()
 
@@ -108,115 +135,29 @@ class AutoviaScraper:
             logger.error(f"Error loading cookies: {e}")
             return False
 
-    def save_cookies(self):
-        cookies = self.driver.get_cookies()
-        with open(self.cookies_file, 'wb') as file:
-            pickle.dump(cookies, file)
-
+    @timed('extract_car_data')
     def extract_car_data(self) -> Optional[CarData]:
         try:
-            url = self.driver.current_url
-
-            #check if advertisement exists in db
-            if project_db.if_advertisement_exists(url):
-                logger.info(f"Advertisement already exists in DB: {url}")
+            self.readiness.element(self.driver, (By.XPATH, FIELDS['brand']), 'detail_title', timeout=10)
+            result = extract_fields(self.driver, FIELDS, site=self.webpage_name)
+            if self.snapshots:
+                self.snapshots.save(result['url'], self.webpage_name, self.driver.page_source)
+
+            missing = missing_fields(result, REQUIRED_FIELDS)
+            if missing:
+                logger.error(f"Error extracting car data: missing {missing} on {result['url']}")
+                DIAGNOSTICS.report(self.webpage_name, result['url'], missing, FIELDS, driver=self.driver)
                 return None
 
-
-            #extract data
-            brand = WebDriverWait(self.driver, 10).until(
-                EC.presence_of_element_located((By.XPATH, '/html/body/main/div[2]/div[1]/div/h1'))
-            ).text
-            model_ver  = None
-            price_text = self.driver.find_element(By.CLASS_NAME, 'resp-price-main').text
-            price_text = price_text.strip('€').replace(',', '').replace(' ', '')
-            price = int(price_text)
-            year_text = self.driver.find_element(By.XPATH, "//strong[contains(text(),'Rok:')]/parent::div").text
-            year = year_text.replace('Rok: ', '')
-            location_text = self.driver.find_element(By.XPATH, "//div[@title='Lokalita']").text
-            location = location_text.replace('Lokalita ', '')
-            fuel_text = self.driver.find_element(By.XPATH, "//strong[contains(text(), 'Palivo:')]/parent::div").text
-            fuel = fuel_text.replace('Palivo: ', '')
-            engine_power_text = self.driver.find_element(By.XPATH, "//strong[contains(text(),'Výkon motora:')]/parent::div").text
-            engine_power = engine_power_text.replace('Výkon motora: ', '')
-            gearbox_text = self.driver.find_element(By.XPATH, "//strong[contains(text(),'Prevodovka:')]/parent::div").text
-            gearbox = gearbox_text.replace('Prevodovka: ', '')
-            mileage_text = self.driver.find_element(By.XPATH, "//strong[contains(text(), 'Počet km:')]/parent::div").text
-            mileage = mileage_text.replace('Počet km: ', '')
-
-            return CarData(
-                url=url,
-                brand=brand,
-                model_ver=model_ver,
-                price=price,
-                year=year,
-                location=location,
-                fuel=fuel,
-                engine_power=engine_power,
-                gearbox=gearbox,
-                mileage=mileage
-            )
+            return build_car_data(result['url'], result['values'])
         except Exception as e:
             logger.error(f"Error extracting car data: {e}")
             return None
 
-    def scrape(self):
-        self.setup_driver()
-        time.sleep(20)
-        self.base_window = self.driver.current_window_handle
-        items = self.driver.find_elements(By.CSS_SELECTOR, 'section.resp-search-results div.resp-item')
-        links = []
-        for item in items:
-            try:
-                link = item.find_element(By.CSS_SELECTOR, 'a').get_attribute('href')
-                links.append(link)
-            except NoSuchElementException as e:
-                logger.error(f"Error extracting link: {e}")
-
-        for i in range (0, len(links), BATCH_SIZE):
-            batch = links[i:i + BATCH_SIZE]
-            self.process_batch(batch)
-        self.driver.quit()
-
-    def process_batch(self, batch):
-        for link in batch:
-            self.driver.execute_script("window.open('{}');".format(link))
-            time.sleep(1)
-
-        window_handles = self.driver.window_handles[1:]
-
-        for window in window_handles:
-            self.driver.switch_to.window(window)
-            WebDriverWait(self.driver, 30).until(
-                lambda x: x.execute_script("return document.readyState") == "complete"
-            )
-
-            if 'autovia' not in self.driver.current_url:
-                logger.info("Not an autovia link, closing tab.")
-                self.driver.quit()
-                continue
-
-            car_data = self.extract_car_data()
-            if car_data:
-                logger.info(car_data)
-                project_db.add_to_db(
-                    url=car_data.url,
-                    webpage_name='autovia',
-                    brand=car_data.brand,
-                    model_version=car_data.model_ver,
-                    year=car_data.year,
-                    price=car_data.price,
-                    mileage=car_data.mileage,
-                    gearbox=car_data.gearbox,
-                    fuel_type=car_data.fuel,
-                    engine_power=car_data.engine_power,
-                    location=car_data.location
-                )
-            self.driver.close()
-            self.driver.switch_to.window(self.base_window)
+
 def main():
-    scraper = AutoviaScraper(AUTOVIA_URL)
-    scraper.scrape()
+    base_scraper.main(AutoviaScraper, AUTOVIA_URL)
+
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,345 @@
+import argparse
+import logging
+import os
+import pickle
+import sys
+import threading
+import time
+from typing import Optional
+
+from selenium import webdriver
+from selenium.common import TimeoutException
+from selenium.webdriver.common.by import By
+
+import project_db
+from diagnostics import DIAGNOSTICS, DIAGNOSTICS_DIR
+from driver_pool import DriverPool
+from driver_profile import PROFILES, apply_request_blocking, build_options, open_tab
+from frontier import Frontier
+from http_engine import HttpEngine, load_cookie_jar
+from listing_crawler import IncrementalFilter, chunked, iter_listing_links
+from memory_governor import MemoryGovernor
+from metrics import REGISTRY, STAGE_METRIC, timed
+from page_ready import PageReadiness
+from rate_limit import RateLimiter
+from session_manager import SESSION_DIR, BrowserSession
+from snapshot_store import SnapshotStore
+from tab_concurrency import TabController
+from url_index import SeenUrlIndex
+
+CONSENT_SELECTORS = [
+    (By.CLASS_NAME, 'sc-btn-primary'),
+    (By.CLASS_NAME, 'privacy-consent-accept'),
+    (By.CSS_SELECTOR, '[data-testid="consent-button"]'),
+    (By.XPATH, '//button[contains(text(), "Accept All")]'),
+]
+
+
+class BaseScraper:
+    """Crawl orchestration shared by the site scrapers.
+
+    Subclasses set the site attributes below, ``site_module`` to the name of
+    the module holding FIELDS, REQUIRED_FIELDS and build_car_data for the
+    http engine, and implement handle_cookies, load_cookies and
+    extract_car_data. Log records go to the logger of ``site_module``.
+    """
+
+    webpage_name = None
+    domain = None
+    site_module = None
+    listing_ready = None
+    detail_ready = None
+    window_size = '1920,1080'
+    # Hosts the lean profile must never block
+    lean_allowlist = ()
+    # Cookies that must be present for stored consent to still count
+    consent_cookies = ('euconsent-v2',)
+    page_param = 'page'
+
+    def __init__(self, url: str, cookies_file: str, url_index: Optional[SeenUrlIndex] = None,
+                 snapshot_dir: Optional[str] = None, profile: str = 'full', allowlist: tuple = (),
+                 session_dir: Optional[str] = None, rate_limiter: Optional[RateLimiter] = None,
+                 recycle_pages: Optional[int] = 500, recycle_rss_mb: Optional[float] = 1500):
+        self.url = url
+        self.logger = logging.getLogger(self.site_module)
+        self.session_dir = session_dir
+        self.session = BrowserSession(session_dir, self.consent_cookies) if session_dir else None
+        self.cookies_file = cookies_file
+        self.profile = profile
+        self.allowlist = tuple(self.lean_allowlist) + tuple(allowlist)
+        self.url_index = url_index
+        self.snapshot_dir = snapshot_dir
+        self.snapshots = SnapshotStore(snapshot_dir) if snapshot_dir else None
+        self.driver = None
+        self.base_window = None
+        self.frontier = Frontier(self.webpage_name)
+        self.writer = project_db.AdvertisementWriter(on_write=self.frontier.mark_done)
+        self.readiness = PageReadiness()
+        self.rate_limiter = rate_limiter
+        self.governor = MemoryGovernor(self.webpage_name, max_pages=recycle_pages, max_rss_mb=recycle_rss_mb)
+
+    @timed('setup_driver')
+    def setup_driver(self):
+        options = build_options(self.window_size, self.profile, self.allowlist)
+        if self.session:
+            for argument in self.session.chrome_arguments():
+                options.add_argument(argument)
+        self.driver = webdriver.Chrome(options = options)
+        if self.profile == 'lean':
+            apply_request_blocking(self.driver, self.allowlist)
+        self.driver.get(self.url)
+        if self.session and self.session.consent_valid(self.driver):
+            self.base_window = self.driver.window_handles[0]
+            return
+        self.handle_cookies()
+
+        try:
+            try:
+                cookie_button = self.readiness.any_clickable(self.driver, CONSENT_SELECTORS, 'consent', timeout=5)
+                cookie_button.click()
+            except TimeoutException:
+                pass
+
+            self.load_cookies()
+            self.driver.refresh()
+            self.base_window = self.driver.window_handles[0]
+            if self.session:
+                self.session.mark_consented()
+        except Exception as e:
+            self.logger.error(f"Error setting up driver: {e}")
+            self.driver.quit()
+            raise
+
+    def handle_cookies(self):
+        raise NotImplementedError
+
+    def load_cookies(self) -> bool:
+        raise NotImplementedError
+
+    def extract_car_data(self):
+        raise NotImplementedError
+
+    def save_cookies(self):
+        """Replaces the cookies file in one step, pool workers recycling at the same time never mix their writes"""
+        cookies = self.driver.get_cookies()
+        partial = f'{self.cookies_file}.{os.getpid()}.{threading.get_ident()}'
+        with open(partial, 'wb') as file:
+            pickle.dump(cookies, file)
+        os.replace(partial, self.cookies_file)
+
+    @timed('detail_load')
+    def wait_for_detail(self) -> bool:
+        try:
+            self.readiness.element(self.driver, self.detail_ready, 'detail')
+            return True
+        except TimeoutException:
+            self.logger.info(f"Detail page not ready: {self.driver.current_url}")
+            return False
+
+    @timed('rate_limit')
+    def throttle(self) -> None:
+        """Waits for the domain rate limit before a page request"""
+        if self.rate_limiter:
+            self.rate_limiter.acquire()
+
+    def recycle_driver(self, reason: str) -> None:
+        """Replaces the driver by a fresh one with the same cookies, the frontier is not touched"""
+        try:
+            self.save_cookies()
+        except Exception as e:
+            self.logger.info(f"Could not save cookies before recycling the driver: {e}")
+        self.driver.quit()
+        self.setup_driver()
+        self.base_window = self.driver.current_window_handle
+        self.governor.recycled(reason)
+
+    def worker_kwargs(self) -> dict:
+        """Constructor arguments for a pool worker copy of this scraper"""
+        return dict(url=self.url, snapshot_dir=self.snapshot_dir, profile=self.profile,
+                    allowlist=self.allowlist, session_dir=self.session_dir, rate_limiter=self.rate_limiter,
+                    recycle_pages=self.governor.max_pages, recycle_rss_mb=self.governor.max_rss_mb)
+
+    def http_extract(self, links):
+        """Extracts links over http, yields the ones that need the browser"""
+        on_page = (lambda url, html: self.snapshots.save(url, self.webpage_name, html)) if self.snapshots else None
+        engine = HttpEngine(sys.modules[self.site_module], cookies=load_cookie_jar(self.cookies_file),
+                            on_page=on_page, rate_limiter=self.rate_limiter)
+        for chunk in chunked(links, 50):
+            cars, fallback = engine.extract(chunk)
+            REGISTRY.inc('carscraper_pages_total', len(cars), site=self.webpage_name, result='extracted_http')
+            # Cars come back in the order of the links they were extracted from
+            fallback_links = set(fallback)
+            extracted = [link for link in chunk if link not in fallback_links]
+            for link, car_data in zip(extracted, cars):
+                self.logger.info(car_data)
+                self.writer.add_car_data(car_data, self.webpage_name, source_url=link)
+            self.logger.info(f"Http engine extracted {len(cars)} ads, {len(fallback)} left for the browser")
+            yield from fallback
+
+    def page_url(self, page: int) -> str:
+        return f"{self.url}&{self.page_param}={page}"
+
+    def scrape(self, workers: int = 1, mode: str = 'thread', engine: str = 'browser',
+               max_pages: int = 1, max_items: Optional[int] = None, queue_size: int = 50,
+               incremental: bool = True, known_run: int = 10, resume: bool = False,
+               tabs: Optional[int] = None, max_tabs: int = 20):
+        if self.url_index is None:
+            self.url_index = SeenUrlIndex.load()
+        self.setup_driver()
+        controller = None
+        try:
+            self.base_window = self.driver.current_window_handle
+            if resume:
+                self.logger.info(f"Resuming {self.frontier.recover()} unfinished urls of the last run")
+            else:
+                self.frontier.reset()
+
+            listing = iter_listing_links(self, max_pages, max_items)
+            if incremental:
+                high_water_mark = project_db.get_high_water_mark(self.webpage_name)
+                incremental_filter = IncrementalFilter(self.url_index, high_water_mark, known_run)
+                links = incremental_filter(listing)
+            else:
+                links = self.url_index.filter_iter(listing)
+            links = self.frontier.claimed(links)
+            if engine == 'http':
+                links = self.http_extract(links)
+
+            if workers > 1:
+                pool = DriverPool(type(self), self.worker_kwargs(),
+                                  workers=workers, mode=mode, writer=self.writer, queue_size=queue_size)
+                pool.run(links)
+            else:
+                if tabs:
+                    controller = TabController.fixed(tabs, self.webpage_name)
+                else:
+                    controller = TabController(self.webpage_name, maximum=max_tabs, rate_limiter=self.rate_limiter)
+                for batch in controller.batches(links):
+                    started = time.perf_counter()
+                    failed = self.process_batch(batch)
+                    controller.update(len(batch), failed, time.perf_counter() - started,
+                                      self.governor.memory_pressure())
+                    reason = self.governor.pages_done(self.driver, len(batch))
+                    if reason:
+                        self.recycle_driver(reason)
+        finally:
+            # Buffered rows are stored and the browser closed however the crawl ended
+            inserted, skipped = self.writer.close()
+            try:
+                self.driver.quit()
+            except Exception as e:
+                self.logger.info(f"Could not quit the driver: {e}")
+        if controller:
+            self.logger.info(f"Tab concurrency: {controller.report()}")
+        self.logger.info(f"Advertisements inserted: {inserted}, duplicates skipped: {skipped}")
+        self.logger.info(f"Time spent waiting on pages: {self.readiness.report()}")
+        self.logger.info(f"Frontier: {self.frontier.counts()}")
+        self.logger.info(f"Browser memory: {self.governor.report()}")
+        project_db.update_crawl_state(self.webpage_name, new_listings=inserted)
+
+        # Only move the mark once this crawl has connected with already stored listings
+        if incremental and incremental_filter.newest and (incremental_filter.stopped_early or high_water_mark is None):
+            project_db.set_high_water_mark(self.webpage_name, incremental_filter.newest)
+
+    def process_batch(self, batch) -> int:
+        """Extracts a batch of links in parallel tabs, returns the number of pages that failed"""
+        # Open new tabs for each link, remembering which tab shows which link
+        tabs = []
+        with REGISTRY.timer(STAGE_METRIC, stage='tab_open', site=self.webpage_name):
+            for link in batch:
+                self.throttle()
+                blocking = self.allowlist if self.profile == 'lean' else None
+                tabs.extend((link, window) for window in open_tab(self.driver, link, blocking))
+
+        failed = 0
+        for link, window in tabs:
+            self.driver.switch_to.window(window)
+            if not self.wait_for_detail():
+                REGISTRY.inc('carscraper_pages_total', site=self.webpage_name, result='not_ready')
+                self.frontier.failed(link, 'detail page not ready')
+                failed += 1
+                self.driver.close()
+                continue
+
+            if self.domain not in self.driver.current_url:
+                self.logger.info(f"Not a {self.webpage_name} page, closing tab.")
+                self.frontier.failed(link, f'redirected to {self.driver.current_url}', retry=False)
+                self.driver.close()
+                continue
+
+            car_data = self.extract_car_data()
+            REGISTRY.inc('carscraper_pages_total', site=self.webpage_name, result='extracted' if car_data else 'failed')
+            if car_data:
+                self.logger.info(car_data)
+                self.writer.add_car_data(car_data, self.webpage_name, source_url=link)
+            else:
+                self.frontier.failed(link, 'extraction failed')
+                failed += 1
+            self.driver.close()
+
+        # Return to the main window
+        self.driver.switch_to.window(self.base_window)
+        return failed
+
+
+def add_run_arguments(parser: argparse.ArgumentParser) -> None:
+    """Options shared by the site scrapers and the scheduler"""
+    parser.add_argument('--pages', type=int, default=1, help='number of result pages to crawl per site')
+    parser.add_argument('--max-items', type=int, default=None, help='stop a site after this many listing links')
+    parser.add_argument('--full', action='store_true',
+                        help='crawl all pages instead of stopping at already known listings')
+    parser.add_argument('--resume', action='store_true',
+                        help='continue the urls the last run left unfinished instead of starting over')
+    parser.add_argument('--engine', choices=('browser', 'http'), default='browser',
+                        help='http fetches detail pages without a browser, falling back to it when needed')
+    parser.add_argument('--snapshots', metavar='DIR', default=None,
+                        help='store compressed detail page html in DIR for offline re-parsing')
+    parser.add_argument('--profile', choices=PROFILES, default='full',
+                        help='lean blocks images, fonts, media and trackers and disables unneeded Chrome features')
+    parser.add_argument('--sessions', metavar='DIR', nargs='?', const=SESSION_DIR, default=None,
+                        help='keep a warm Chrome profile with consent state in DIR across runs')
+    parser.add_argument('--metrics-json', metavar='FILE', default=None, help='write a per-run metrics summary')
+    parser.add_argument('--metrics-prom', metavar='FILE', default=None, help='write metrics in Prometheus text format')
+    parser.add_argument('--metrics-port', type=int, default=None, help='serve Prometheus metrics on this port')
+
+
+def run_scrape_kwargs(args: argparse.Namespace) -> dict:
+    """scrape() arguments from the options of add_run_arguments"""
+    return dict(engine=args.engine, max_pages=args.pages, max_items=args.max_items, incremental=not args.full,
+                resume=args.resume)
+
+
+def main(scraper_cls, *scraper_args) -> None:
+    """Command line of a single site scraper, scraper_args are its leading constructor arguments"""
+    parser = argparse.ArgumentParser(description=f'Scrape car adverts from {scraper_cls.webpage_name}')
+    add_run_arguments(parser)
+    parser.add_argument('--workers', type=int, default=1, help='number of parallel browsers')
+    parser.add_argument('--mode', choices=('thread', 'process'), default='thread')
+    parser.add_argument('--tabs', type=int, default=None,
+                        help='open this many tabs at once instead of adapting the number to page load times')
+    parser.add_argument('--max-tabs', type=int, default=20, help='upper limit of the adaptive tab count')
+    parser.add_argument('--recycle-pages', type=int, default=500,
+                        help='replace a browser after this many detail pages, 0 disables')
+    parser.add_argument('--recycle-rss', type=float, default=1500, metavar='MB',
+                        help='replace a browser once its process tree uses this much memory, 0 disables')
+    parser.add_argument('--allow', metavar='DOMAIN', action='append', default=[],
+                        help='domain the lean profile must not block, may be repeated')
+    parser.add_argument('--diagnostics', metavar='DIR', default=DIAGNOSTICS_DIR,
+                        help='where to keep page source and screenshots of extraction failures')
+    parser.add_argument('--diagnostics-rate', type=float, default=0.1,
+                        help='fraction of repeated extraction failures to capture, 0 captures only the first of each')
+    args = parser.parse_args()
+    DIAGNOSTICS.root = args.diagnostics
+    DIAGNOSTICS.sample_rate = args.diagnostics_rate
+    if args.metrics_port:
+        REGISTRY.serve(args.metrics_port)
+
+    session_dir = os.path.join(args.sessions, scraper_cls.webpage_name) if args.sessions else None
+    scraper = scraper_cls(*scraper_args, snapshot_dir=args.snapshots, profile=args.profile,
+                          allowlist=tuple(args.allow), recycle_pages=args.recycle_pages,
+                          recycle_rss_mb=args.recycle_rss, session_dir=session_dir)
+    try:
+        scraper.scrape(workers=args.workers, mode=args.mode, tabs=args.tabs, max_tabs=args.max_tabs,
+                       **run_scrape_kwargs(args))
+    finally:
+        REGISTRY.export(args.metrics_json, args.metrics_prom)
@@ -0,0 +1,359 @@
+"""Offline end to end benchmark of the scrapers.
+
+Serves listing, detail and cookie consent fixtures for both sites from a
+local HTTP server, runs the full ``scrape()`` path against it on a scratch
+database and prints a JSON result line, e.g.::
+
+    python benchmark.py --site autovia --pages 3 --items 20 --output bench.jsonl
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from string import Template
+from urllib.parse import parse_qs, quote, urlsplit
+
+# The benchmark never touches the real database
+if 'CARSCRAPER_DATABASE_URI' not in os.environ:
+    os.environ['CARSCRAPER_DATABASE_URI'] = 'sqlite:///' + os.path.join(
+        tempfile.mkdtemp(prefix='carscraper-bench-'), 'bench.sqlite')
+
+import project_db
+from autoscout24_scraper import Autoscout24Scraper
+from autovia_scraper import AutoviaScraper
+from metrics import REGISTRY
+from url_index import SeenUrlIndex
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_fixtures')
+
+BRANDS = [('Skoda', 'Octavia'), ('Volkswagen', 'Golf'), ('BMW', '320'), ('Audi', 'A4'), ('Toyota', 'Corolla')]
+FUELS = ['Diesel', 'Gasoline', 'Electric/Gasoline']
+GEARBOXES = ['Manual', 'Automatic']
+LOCATIONS = ['Bratislava', 'Wien', 'München', 'Brno']
+
+
+def _fixture(name: str) -> Template:
+    with open(os.path.join(FIXTURE_DIR, name), encoding='utf-8') as f:
+        return Template(f.read())
+
+
+class FixtureSite:
+    """Generates deterministic listing and detail pages from the fixture templates"""
+
+    def __init__(self, name: str, pages: int, items: int, seed: int = 0):
+        self.name = name
+        self.pages = pages
+        self.items = items
+        self.seed = seed
+        self.listing = _fixture(f'{name}_listing.html')
+        self.listing_item = _fixture(f'{name}_listing_item.html')
+        self.detail = _fixture(f'{name}_detail.html')
+        self.consent = _fixture(f'{name}_consent.html')
+
+    def ad(self, ad_id: str) -> dict:
+        rnd = random.Random(f'{self.seed}-{ad_id}')
+        brand, model = rnd.choice(BRANDS)
+        price = rnd.randrange(2_000, 99_000, 10)
+        mileage = rnd.randrange(1_000, 300_000)
+        kw = rnd.randrange(50, 250)
+        thousands = ',' if self.name == 'autoscout24' else ' '
+        return dict(
+            ad_id=ad_id,
+            brand=brand,
+            model=model,
+            model_version=f'{model} {rnd.choice(["Style", "Comfort", "Sport"])}',
+            price_text=f'{price:,}'.replace(',', thousands),
+            mileage=f'{mileage:,}'.replace(',', thousands),
+            gearbox=rnd.choice(GEARBOXES),
+            month=f'{rnd.randrange(1, 13):02d}',
+            year=rnd.randrange(2005, 2025),
+            fuel=rnd.choice(FUELS),
+            kw=kw,
+            hp=round(kw / 0.7355),
+            location=rnd.choice(LOCATIONS),
+        )
+
+    def listing_page(self, page: int, next_page: str, consent: str = '') -> str:
+        items = ''
+        if page <= self.pages:
+            items = ''.join(self.listing_item.substitute(self.ad(f'{page}-{i}')) for i in range(self.items))
+        return self.listing.substitute(page=page, items=items, next_page=next_page, consent=consent,
+                                       total=self.pages * self.items)
+
+    def detail_page(self, ad_id: str) -> str:
+        return self.detail.substitute(self.ad(ad_id))
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    server_version = 'CarscraperBench/1.0'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, body: str, status: int = 200, headers: dict = None) -> None:
+        data = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_static(self, name: str) -> None:
+        """Images and fonts the scrapers never read, sized like the real ones"""
+        content_type = 'font/woff2' if name.endswith('.woff2') else 'image/jpeg'
+        data = bytes(self.server.static_size)
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        server = self.server
+        parts = urlsplit(self.path)
+        query = parse_qs(parts.query)
+        segments = parts.path.strip('/').split('/')
+        site = server.sites.get(segments[0])
+        has_consent = 'consent=1' in (self.headers.get('Cookie') or '')
+        if server.latency:
+            time.sleep(server.latency)
+
+        if segments[0] == 'static':
+            return self._send_static(segments[-1])
+        if site is None:
+            return self._send('not found', 404)
+
+        if site.name == 'autoscout24':
+            if segments[1:] == ['lst']:
+                if not has_consent:
+                    return self._send('', 302, {'Location': f'/autoscout24/consent?next={quote(self.path, safe="")}'})
+                page = int(query.get('page', ['1'])[0])
+                return self._send(site.listing_page(page, f'/autoscout24/lst?page={page + 1}'))
+            if segments[1:2] == ['consent']:
+                return self._send(site.consent.substitute(next=query.get('next', ['/autoscout24/lst'])[0]))
+            if segments[1:2] == ['offers'] and len(segments) == 3:
+                server.record_detail(self.path)
+                return self._send(site.detail_page(segments[2]))
+        else:
+            if segments[1:] == ['osobne-auta']:
+                page = int(query.get('p[page]', ['1'])[0])
+                consent = '' if has_consent else (
+                    '<div id="sp_message_container"><iframe id="sp_message_iframe_1235490" '
+                    'name="sp_message_iframe_1235490" src="/autovia/consent"></iframe></div>')
+                return self._send(site.listing_page(page, f'/autovia/osobne-auta/?p%5Bpage%5D={page + 1}', consent))
+            if segments[1:] == ['consent']:
+                return self._send(site.consent.substitute())
+            if segments[1:2] == ['inzerat'] and len(segments) == 3:
+                server.record_detail(self.path)
+                return self._send(site.detail_page(segments[2]))
+        return self._send('not found', 404)
+
+
+class FixtureServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, sites: dict, latency: float = 0.0, static_size: int = 150_000):
+        super().__init__(('127.0.0.1', 0), FixtureHandler)
+        self.sites = sites
+        self.latency = latency
+        self.static_size = static_size
+        self.detail_requests = {}
+        self._lock = threading.Lock()
+
+    @property
+    def base_url(self) -> str:
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+    def record_detail(self, path: str) -> None:
+        with self._lock:
+            self.detail_requests.setdefault(path, time.monotonic())
+
+
+class BenchWriter(project_db.AdvertisementWriter):
+    """AdvertisementWriter recording when each ad is handed over and how long inserts take"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.handed_over = {}
+        self.write_seconds = 0.0
+
+    def add_car_data(self, car_data, webpage_name, date_added=None, source_url=None):
+        self.handed_over.setdefault(urlsplit(car_data.url).path, time.monotonic())
+        super().add_car_data(car_data, webpage_name, date_added, source_url)
+
+    def _write(self, rows, sources=()):
+        start = time.monotonic()
+        try:
+            return super()._write(rows, sources)
+        finally:
+            self.write_seconds += time.monotonic() - start
+
+
+class BenchAutoscout24Scraper(Autoscout24Scraper):
+    domain = '127.0.0.1'
+    consent_cookies = ('consent',)
+
+
+class BenchAutoviaScraper(AutoviaScraper):
+    domain = '127.0.0.1'
+    consent_cookies = ('consent',)
+
+
+class RssSampler(threading.Thread):
+    """Samples the summed RSS of this process and its children (chromedriver, Chrome)"""
+
+    def __init__(self, interval: float = 0.2):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak = 0
+        self._stopped = threading.Event()
+
+    def run(self):
+        process = psutil.Process()
+        while not self._stopped.is_set():
+            total = 0
+            for proc in [process] + process.children(recursive=True):
+                try:
+                    total += proc.memory_info().rss
+                except psutil.Error:
+                    pass
+            self.peak = max(self.peak, total)
+            self._stopped.wait(self.interval)
+
+    def stop(self) -> int:
+        self._stopped.set()
+        self.join()
+        return self.peak
+
+
+def _percentile(values: list, fraction: float):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        return None
+
+
+def _seed_webpages(base_url: str) -> None:
+    with project_db.Session() as session:
+        with session.begin():
+            for name in ('autoscout24', 'autovia'):
+                if not session.query(project_db.Webpage).filter_by(page_name=name).first():
+                    session.add(project_db.Webpage(url=f'{base_url}/{name}', page_name=name))
+
+
+def run_benchmark(site: str, pages: int = 2, items: int = 10, workers: int = 1, mode: str = 'thread',
+                  engine: str = 'browser', latency: float = 0.0, profile: str = 'full',
+                  session_dir: str = None, scrape_kwargs: dict = None) -> dict:
+    sites = {name: FixtureSite(name, pages, items) for name in ('autoscout24', 'autovia')}
+    server = FixtureServer(sites, latency)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    _seed_webpages(server.base_url)
+
+    cookies_dir = tempfile.mkdtemp(prefix='carscraper-bench-cookies-')
+    if site == 'autoscout24':
+        scraper = BenchAutoscout24Scraper(f'{server.base_url}/autoscout24/lst?sort=age',
+                                          os.path.join(cookies_dir, 'autoscout24.pkl'), url_index=SeenUrlIndex(),
+                                          profile=profile, session_dir=session_dir)
+    else:
+        scraper = BenchAutoviaScraper(f'{server.base_url}/autovia/osobne-auta/?p%5Border%5D=1',
+                                      url_index=SeenUrlIndex(), profile=profile, session_dir=session_dir)
+        scraper.cookies_file = os.path.join(cookies_dir, 'autovia.pkl')
+    writer = BenchWriter(on_write=scraper.frontier.mark_done)
+    scraper.writer = writer
+
+    REGISTRY.reset()
+    sampler = RssSampler() if psutil else None
+    if sampler:
+        sampler.start()
+    start = time.monotonic()
+    try:
+        scraper.scrape(workers=workers, mode=mode, engine=engine, max_pages=pages, incremental=False,
+                       **(scrape_kwargs or {}))
+    finally:
+        seconds = time.monotonic() - start
+        server.shutdown()
+    if sampler:
+        peak_rss = sampler.stop()
+    else:
+        usage_self = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        usage_children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+        peak_rss = (usage_self + usage_children) * 1024
+
+    latencies = [writer.handed_over[path] - requested
+                 for path, requested in server.detail_requests.items() if path in writer.handed_over]
+    return dict(
+        timestamp=datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        revision=_git_revision(),
+        site=site,
+        engine=engine,
+        workers=workers,
+        mode=mode,
+        profile=profile,
+        warm_session=session_dir is not None,
+        listing_pages=pages,
+        items_per_page=items,
+        server_latency_ms=round(latency * 1000),
+        seconds=round(seconds, 3),
+        detail_pages=len(server.detail_requests),
+        extracted=len(writer.handed_over),
+        pages_per_sec=round(len(server.detail_requests) / seconds, 3) if seconds else None,
+        latency_p50_ms=round(_percentile(latencies, 0.5) * 1000, 1) if latencies else None,
+        latency_p95_ms=round(_percentile(latencies, 0.95) * 1000, 1) if latencies else None,
+        db_rows_inserted=writer.inserted,
+        db_insert_rows_per_sec=round(writer.inserted / writer.write_seconds, 1) if writer.write_seconds else None,
+        peak_rss_mb=round(peak_rss / 2 ** 20, 1),
+        wait_seconds=scraper.readiness.report()['total_seconds'],
+        stages=REGISTRY.summary()['histograms'],
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the scrapers against local fixture sites')
+    parser.add_argument('--site', choices=('autoscout24', 'autovia'), default='autoscout24')
+    parser.add_argument('--pages', type=int, default=2, help='listing pages served')
+    parser.add_argument('--items', type=int, default=10, help='ads per listing page')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--mode', choices=('thread', 'process'), default='thread')
+    parser.add_argument('--engine', choices=('browser', 'http'), default='browser')
+    parser.add_argument('--profile', choices=('full', 'lean'), default='full', help='driver profile')
+    parser.add_argument('--sessions', metavar='DIR', default=None,
+                        help='reuse a browser session in DIR, run twice to measure a warm start')
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='artificial server latency per request')
+    parser.add_argument('--output', metavar='FILE', default=None, help='append the JSON result to FILE')
+    args = parser.parse_args()
+
+    result = run_benchmark(args.site, pages=args.pages, items=args.items, workers=args.workers, mode=args.mode,
+                           engine=args.engine, latency=args.latency_ms / 1000, profile=args.profile,
+                           session_dir=os.path.join(args.sessions, args.site) if args.sessions else None)
+    line = json.dumps(result, sort_keys=True)
+    print(line)
+    if args.output:
+        with open(args.output, 'a', encoding='utf-8') as f:
+            f.write(line + '\n')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
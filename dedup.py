@@ -0,0 +1,239 @@
+import re
+import unicodedata
+from collections import defaultdict
+from typing import Optional, Sequence
+
+from sqlalchemy import ForeignKey, Index, Integer, String, delete, select, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Mapped, mapped_column
+
+import project_db
+from project_db import Advertisement, Base, Session
+
+REBUILD_CHUNK_SIZE = 5000
+
+# Blocking granularity, neighbouring buckets are searched too so values close
+# to a bucket edge still meet
+MILEAGE_BUCKET_KM = 5000
+POWER_BUCKET_KW = 5
+
+MATCH_THRESHOLD = 0.75
+
+FUEL_NAMES = {
+    'diesel': 'diesel', 'nafta': 'diesel',
+    'petrol': 'petrol', 'gasoline': 'petrol', 'benzin': 'petrol',
+    'electric': 'electric', 'elektro': 'electric', 'elektricky': 'electric',
+    'hybrid': 'hybrid', 'lpg': 'lpg', 'cng': 'cng',
+}
+
+
+class AdBlock(Base):
+    __tablename__ = "ad_blocks"
+    __table_args__ = (
+        Index('ix_ad_blocks_block_key', 'block_key'),
+    )
+
+    advertisement_id: Mapped[int] = mapped_column(ForeignKey('advertisements.id'), primary_key=True)
+    block_key: Mapped[str] = mapped_column(String(200), nullable=False)
+
+
+class AdCluster(Base):
+    __tablename__ = "ad_clusters"
+    __table_args__ = (
+        Index('ix_ad_clusters_cluster_id', 'cluster_id'),
+    )
+
+    advertisement_id: Mapped[int] = mapped_column(ForeignKey('advertisements.id'), primary_key=True)
+    cluster_id: Mapped[int] = mapped_column(Integer, nullable=False, comment='lowest advertisement id of the cluster')
+    score: Mapped[Optional[int]] = mapped_column(Integer, default=None, nullable=True,
+                                                 comment='best match score in percent')
+
+
+Base.metadata.create_all(bind=project_db.engine, tables=[AdBlock.__table__, AdCluster.__table__])
+
+
+def _fold(text: Optional[str]) -> str:
+    text = unicodedata.normalize('NFKD', text or '')
+    return ''.join(char for char in text if not unicodedata.combining(char)).lower()
+
+
+def title_tokens(brand: Optional[str], model_version: Optional[str]) -> list:
+    """'Škoda Octavia' + '2.0 TDI Style' -> ['skoda', 'octavia', '2.0', 'tdi', 'style']"""
+    return re.findall(r'[a-z0-9.]+', _fold(f'{brand or ""} {model_version or ""}'))
+
+
+def normalize_fuel(fuel: Optional[str]) -> str:
+    for word in re.findall(r'[a-z]+', _fold(fuel)):
+        if word in FUEL_NAMES:
+            return FUEL_NAMES[word]
+    return ''
+
+
+def _block_key(make: str, year, mileage_bucket: int, power_bucket: int, fuel: str) -> str:
+    return f'{make}|{year}|{mileage_bucket}|{power_bucket}|{fuel}'
+
+
+def block_keys(row, neighbours: bool = False) -> list:
+    """Blocking keys of an advertisement, its own key first.
+
+    Ads without make, year, mileage or power can't be matched reliably and
+    get no key.
+    """
+    tokens = title_tokens(row['brand'], row['model_version'])
+    if not tokens or row['year_value'] is None or row['mileage_km'] is None or row['engine_power_kw'] is None:
+        return []
+    mileage_bucket = row['mileage_km'] // MILEAGE_BUCKET_KM
+    power_bucket = row['engine_power_kw'] // POWER_BUCKET_KW
+    fuel = normalize_fuel(row['fuel_type'])
+    offsets = (0, -1, 1) if neighbours else (0,)
+    return [_block_key(tokens[0], row['year_value'], mileage_bucket + m, power_bucket + p, fuel)
+            for m in offsets for p in offsets]
+
+
+def match_score(a, b) -> float:
+    """Similarity of two ads from the same block, 0 to 1"""
+    score = 0.0
+    mileage = max(a['mileage_km'], b['mileage_km'], 1)
+    score += 0.3 * max(0.0, 1 - abs(a['mileage_km'] - b['mileage_km']) / (0.05 * mileage))
+    score += 0.2 * max(0.0, 1 - abs(a['engine_power_kw'] - b['engine_power_kw']) / POWER_BUCKET_KW)
+    if a['price'] and b['price']:
+        score += 0.3 * max(0.0, 1 - abs(a['price'] - b['price']) / (0.15 * max(a['price'], b['price'])))
+    tokens_a = set(title_tokens(a['brand'], a['model_version']))
+    tokens_b = set(title_tokens(b['brand'], b['model_version']))
+    score += 0.2 * len(tokens_a & tokens_b) / max(len(tokens_a | tokens_b), 1)
+    return score
+
+
+MATCH_COLUMNS = (Advertisement.id, Advertisement.webpage_id, Advertisement.brand, Advertisement.model_version,
+                 Advertisement.price, Advertisement.fuel_type, Advertisement.year_value, Advertisement.mileage_km,
+                 Advertisement.engine_power_kw)
+
+
+def link_duplicates(session, rows: Sequence) -> int:
+    """Indexes advertisement rows with ids and links them to matching ads of other sites.
+
+    Only ads sharing a blocking key are compared. Matches join or merge
+    clusters, which are named after their lowest advertisement id. Returns
+    the number of links made.
+    """
+    keyed = [(row, block_keys(row, neighbours=True)) for row in rows]
+    keyed = [(row, keys) for row, keys in keyed if keys]
+    if not keyed:
+        return 0
+    session.execute(
+        sqlite_insert(AdBlock).on_conflict_do_nothing(index_elements=['advertisement_id']),
+        [dict(advertisement_id=row['id'], block_key=keys[0]) for row, keys in keyed]
+    )
+
+    search_keys = {key for _, keys in keyed for key in keys}
+    candidates = defaultdict(list)
+    for candidate in session.execute(
+            select(AdBlock.block_key, *MATCH_COLUMNS)
+            .join(Advertisement, AdBlock.advertisement_id == Advertisement.id)
+            .where(AdBlock.block_key.in_(search_keys))
+    ).mappings():
+        candidates[candidate['block_key']].append(candidate)
+
+    links = []
+    for row, keys in keyed:
+        best = {}
+        for key in keys:
+            for candidate in candidates[key]:
+                if candidate['webpage_id'] == row['webpage_id']:
+                    continue
+                score = match_score(row, candidate)
+                if score >= MATCH_THRESHOLD and score > best.get(candidate['id'], 0):
+                    best[candidate['id']] = score
+        links.extend((row['id'], candidate_id, score) for candidate_id, score in best.items())
+    for ad_id, other_id, score in links:
+        _link(session, ad_id, other_id, round(score * 100))
+    return len(links)
+
+
+def _link(session, ad_id: int, other_id: int, score: int) -> None:
+    clusters = dict(session.execute(
+        select(AdCluster.advertisement_id, AdCluster.cluster_id)
+        .where(AdCluster.advertisement_id.in_((ad_id, other_id)))
+    ).all())
+    cluster_id = min([ad_id, other_id] + list(clusters.values()))
+    old_clusters = set(clusters.values()) - {cluster_id}
+    if old_clusters:
+        session.execute(update(AdCluster).where(AdCluster.cluster_id.in_(old_clusters)).values(cluster_id=cluster_id))
+    stmt = sqlite_insert(AdCluster)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['advertisement_id'],
+        set_=dict(cluster_id=cluster_id)
+    )
+    session.execute(stmt, [dict(advertisement_id=ad_id, cluster_id=cluster_id, score=score),
+                           dict(advertisement_id=other_id, cluster_id=cluster_id, score=score)])
+
+
+def update_clusters(session, rows: Sequence[dict]) -> None:
+    """Insert hook, links newly inserted advertisements in the caller's transaction"""
+    if not rows:
+        return
+    ads = session.execute(
+        select(*MATCH_COLUMNS).where(Advertisement.url.in_([row['url'] for row in rows]))
+    ).mappings().all()
+    link_duplicates(session, ads)
+
+
+def replace_clusters(session, old_rows: Sequence[dict], new_rows: Sequence[dict]) -> None:
+    """Update hook, re-indexes overwritten advertisements whose matched attributes changed.
+
+    Existing cluster links are kept, migrate.py --rebuild-clusters drops
+    links that no longer match.
+    """
+    names = [column.key for column in MATCH_COLUMNS if column.key not in ('id', 'webpage_id')]
+    changed = [(old, new) for old, new in zip(old_rows, new_rows)
+               if any(old[name] != new.get(name) for name in names)]
+    if not changed:
+        return
+    session.execute(delete(AdBlock).where(AdBlock.advertisement_id.in_([old['id'] for old, _ in changed])))
+    update_clusters(session, [new for _, new in changed])
+
+
+def duplicate_ids():
+    """Select of advertisement ids that duplicate an ad of their cluster, exclude them to count each car once"""
+    return select(AdCluster.advertisement_id).where(AdCluster.advertisement_id != AdCluster.cluster_id)
+
+
+def duplicates_of(url: str) -> list:
+    """Urls of the other ads in the cluster of url"""
+    with Session() as session:
+        cluster_id = session.scalar(
+            select(AdCluster.cluster_id)
+            .join(Advertisement, AdCluster.advertisement_id == Advertisement.id)
+            .where(Advertisement.url == url)
+        )
+        if cluster_id is None:
+            return []
+        return session.scalars(
+            select(Advertisement.url)
+            .join(AdCluster, AdCluster.advertisement_id == Advertisement.id)
+            .where(AdCluster.cluster_id == cluster_id, Advertisement.url != url)
+        ).all()
+
+
+def rebuild(chunk_size: int = REBUILD_CHUNK_SIZE) -> None:
+    """Recomputes blocks and clusters from the advertisements table, in id order as if inserted anew"""
+    with Session() as session:
+        with session.begin():
+            session.execute(delete(AdBlock))
+            session.execute(delete(AdCluster))
+    last_id = 0
+    linked = 0
+    while True:
+        with Session() as session:
+            with session.begin():
+                rows = session.execute(
+                    select(*MATCH_COLUMNS)
+                    .where(Advertisement.id > last_id)
+                    .order_by(Advertisement.id)
+                    .limit(chunk_size)
+                ).mappings().all()
+                if not rows:
+                    break
+                linked += link_duplicates(session, rows)
+        last_id = rows[-1]['id']
+        print(f'clustered up to advertisement {last_id}, {linked} duplicate links')
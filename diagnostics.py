@@ -0,0 +1,159 @@
+import atexit
+import gzip
+import hashlib
+import json
+import logging
+import os
+import queue
+import random
+import re
+import threading
+import time
+from collections import Counter
+from typing import Optional
+from urllib.parse import urlsplit
+
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+DIAGNOSTICS_DIR = 'diagnostics'
+
+_ID_PATTERN = re.compile(r'[0-9a-f]{8}-[0-9a-f-]{27}|\d+', re.IGNORECASE)
+
+
+def page_template(url: str) -> str:
+    """Host and path shape of a url, ad ids and slugs reduced so pages of one layout share a template"""
+    parts = urlsplit(url)
+    segments = [segment for segment in parts.path.split('/') if segment]
+    shape = '/'.join(_ID_PATTERN.sub('#', segment) if i == 0 else '*' for i, segment in enumerate(segments))
+    return f"{parts.netloc}/{shape}"
+
+
+class DiagnosticsCapture:
+    """Captures page source and screenshots of extraction failures off the hot path.
+
+    ``report`` is cheap for failures that are not captured: failures are
+    keyed by site, page template and the selectors of the missing fields, and
+    only the first ``per_key_limit`` of a key are considered, the first of
+    them always and later ones with probability ``sample_rate``. A capture
+    reads the page from the driver in the calling thread, compressing and
+    writing it happens on a background thread. Captures beyond
+    ``queue_size`` pending ones are dropped, and the oldest files are
+    deleted once ``root`` grows past ``max_bytes``.
+    """
+
+    def __init__(self, root: str = DIAGNOSTICS_DIR, sample_rate: float = 0.1, per_key_limit: int = 3,
+                 max_bytes: int = 50 * 1024 * 1024, queue_size: int = 20, screenshots: bool = True):
+        self.root = root
+        self.sample_rate = sample_rate
+        self.per_key_limit = per_key_limit
+        self.max_bytes = max_bytes
+        self.queue_size = queue_size
+        self.screenshots = screenshots
+        self.enabled = True
+        self.seen = Counter()
+        self._captured = Counter()
+        self._lock = threading.Lock()
+        self._queue = None
+        self._thread = None
+        self._size = None
+
+    def report(self, site: str, url: str, missing, fields: dict, driver=None, html: Optional[str] = None) -> bool:
+        """Records an extraction failure, returns True if the page was queued for capture"""
+        for name in missing:
+            REGISTRY.inc('carscraper_extraction_failures_total', site=site, field=name)
+        selectors = sorted(fields.get(name, name) for name in missing)
+        key = hashlib.sha1(json.dumps([site, page_template(url), selectors]).encode('utf-8')).hexdigest()[:16]
+        with self._lock:
+            self.seen[key] += 1
+            if not self.enabled or self._captured[key] >= self.per_key_limit:
+                return False
+            if self._captured[key] and random.random() >= self.sample_rate:
+                return False
+            self._captured[key] += 1
+            capture = self._captured[key]
+
+        record = dict(site=site, url=url, missing=list(missing), selectors=selectors, key=key, capture=capture,
+                      template=page_template(url), time=time.strftime('%Y-%m-%dT%H:%M:%S'))
+        try:
+            html = html if html is not None else driver.page_source
+            screenshot = driver.get_screenshot_as_png() if driver is not None and self.screenshots else None
+        except Exception as e:
+            logger.info(f"Could not capture diagnostics for {url}: {e}")
+            return False
+        try:
+            self._start().put_nowait((record, html, screenshot))
+        except queue.Full:
+            REGISTRY.inc('carscraper_diagnostics_dropped_total', site=site)
+            return False
+        return True
+
+    def _start(self) -> queue.Queue:
+        with self._lock:
+            if self._thread is None:
+                self._queue = queue.Queue(self.queue_size)
+                self._thread = threading.Thread(target=self._run, name='diagnostics', daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+            return self._queue
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                self._write(*item)
+            except Exception as e:
+                logger.info(f"Could not write diagnostics: {e}")
+            finally:
+                self._queue.task_done()
+
+    def _write(self, record: dict, html: str, screenshot: Optional[bytes]) -> None:
+        directory = os.path.join(self.root, record['site'])
+        os.makedirs(directory, exist_ok=True)
+        stem = os.path.join(directory, f"{time.strftime('%Y%m%d-%H%M%S')}-{record['key']}-{record['capture']}")
+        files = {f'{stem}.json': json.dumps(record, ensure_ascii=False).encode('utf-8'),
+                 f'{stem}.html.gz': gzip.compress(html.encode('utf-8'))}
+        if screenshot:
+            files[f'{stem}.png'] = screenshot
+        if self._size is None:
+            self._size = sum(os.path.getsize(path) for path in self._files())
+        for path, data in files.items():
+            with open(path, 'wb') as f:
+                f.write(data)
+            self._size += len(data)
+        if self._size > self.max_bytes:
+            self._rotate()
+
+    def _files(self) -> list:
+        return [os.path.join(directory, name) for directory, _, names in os.walk(self.root) for name in names]
+
+    def _rotate(self) -> None:
+        """Deletes the oldest captures until root is back under max_bytes"""
+        for path in sorted(self._files(), key=os.path.getmtime):
+            if self._size <= self.max_bytes:
+                break
+            size = os.path.getsize(path)
+            os.remove(path)
+            self._size -= size
+
+    def close(self, timeout: float = 10) -> None:
+        """Writes pending captures and stops the background thread"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is None:
+            return
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        thread.join(timeout)
+
+    def summary(self) -> dict:
+        """Failure counts per key, captured or not"""
+        return dict(self.seen)
+
+
+DIAGNOSTICS = DiagnosticsCapture()
@@ -0,0 +1,36 @@
+from metrics import REGISTRY
+
+# Evaluates every field xpath in the page and returns all texts at once, so a
+# detail page costs a single WebDriver round trip instead of one per field.
+EXTRACT_FIELDS_JS = """
+const fields = arguments[0];
+const values = {};
+const missing = {};
+const timings = {};
+for (const [name, xpath] of Object.entries(fields)) {
+    const start = performance.now();
+    let node = null;
+    try {
+        node = document.evaluate(xpath, document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+    } catch (e) {
+        node = null;
+    }
+    const text = node ? (node.innerText || node.textContent || '').split(/\\s+/).join(' ').trim() : '';
+    values[name] = text || null;
+    missing[name] = !text;
+    timings[name] = performance.now() - start;
+}
+return {url: window.location.href, values: values, missing: missing, timings: timings};
+"""
+
+
+def extract_fields(driver, fields: dict, site: str = '') -> dict:
+    """Returns {'url': ..., 'values': {field: text or None}, 'missing': {field: bool}, 'timings': {field: ms}}"""
+    result = driver.execute_script(EXTRACT_FIELDS_JS, fields)
+    for name, milliseconds in result.get('timings', {}).items():
+        REGISTRY.observe('carscraper_field_seconds', milliseconds / 1000, site=site, field=name)
+    return result
+
+
+def missing_fields(result: dict, names) -> list:
+    return [name for name in names if result['missing'].get(name, True)]
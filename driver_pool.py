@@ -0,0 +1,217 @@
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+from typing import Iterable, Optional
+
+from selenium.common import WebDriverException
+
+import project_db
+from frontier import Frontier
+from metrics import REGISTRY, STAGE_METRIC
+from rate_limit import RateLimiter
+
+logger = logging.getLogger(__name__)
+
+_WORKER_DONE = '__worker_done__'
+
+MAX_DRIVER_RESTARTS = 3
+# Seconds to wait for each worker to finish its current page on shutdown
+WORKER_JOIN_TIMEOUT = 60
+
+
+def _start_driver(scraper) -> bool:
+    try:
+        scraper.setup_driver()
+        return True
+    except Exception as e:
+        logger.error(f"Worker could not start driver: {e}")
+        return False
+
+
+def _quit_driver(scraper) -> None:
+    try:
+        scraper.driver.quit()
+    except Exception:
+        pass
+
+
+def _process(scraper, url: str, results) -> None:
+    scraper.throttle()
+    with REGISTRY.timer(STAGE_METRIC, stage='page_load', site=scraper.webpage_name):
+        scraper.driver.get(url)
+    if not scraper.wait_for_detail():
+        scraper.frontier.failed(url, 'detail page not ready')
+        return
+    if scraper.domain not in scraper.driver.current_url:
+        logger.info(f"Not a {scraper.domain} page, skipping: {url}")
+        scraper.frontier.failed(url, f'redirected to {scraper.driver.current_url}', retry=False)
+        return
+    car_data = scraper.extract_car_data()
+    REGISTRY.inc('carscraper_pages_total', site=scraper.webpage_name,
+                 result='extracted' if car_data else 'failed')
+    if car_data:
+        results.put((url, car_data))
+    else:
+        scraper.frontier.failed(url, 'extraction failed')
+
+
+def _worker(scraper_cls, scraper_kwargs: dict, tasks, results, rate_limit: Optional[tuple] = None) -> None:
+    """Pulls detail urls from tasks and puts (url, CarData) of extracted pages on results.
+
+    ``rate_limit`` is the (rate, burst) of a limiter built inside the worker,
+    for process workers that can't receive one. A crashed driver is
+    restarted up to MAX_DRIVER_RESTARTS times, after that the worker gives up
+    without affecting the other workers. Drivers the scraper's memory
+    governor retires are replaced through the scraper's recycle_driver, which
+    keeps their cookies, without counting as restarts. The driver is quit
+    however the worker ends.
+    """
+    if rate_limit:
+        scraper_kwargs = dict(scraper_kwargs, rate_limiter=RateLimiter(*rate_limit))
+    scraper = scraper_cls(**scraper_kwargs)
+    restarts = 0
+    try:
+        if not _start_driver(scraper):
+            return
+        while True:
+            url = tasks.get()
+            if url is None:
+                break
+            try:
+                _process(scraper, url, results)
+            except WebDriverException as e:
+                logger.error(f"Driver failed on {url}: {e}")
+                scraper.frontier.failed(url, str(e))
+                _quit_driver(scraper)
+                restarts += 1
+                if restarts > MAX_DRIVER_RESTARTS or not _start_driver(scraper):
+                    logger.error("Worker stopping after repeated driver failures")
+                    return
+                scraper.governor.recycled('crash')
+                continue
+            except Exception as e:
+                logger.error(f"Error processing {url}: {e}")
+                scraper.frontier.failed(url, str(e))
+
+            reason = scraper.governor.pages_done(scraper.driver)
+            if reason:
+                try:
+                    scraper.recycle_driver(reason)
+                except Exception as e:
+                    logger.error(f"Worker could not replace its driver: {e}")
+                    return
+        logger.info(f"Worker time spent waiting on pages: {scraper.readiness.report()}")
+        logger.info(f"Worker browser memory: {scraper.governor.report()}")
+    finally:
+        _quit_driver(scraper)
+        results.put(_WORKER_DONE)
+
+
+class DriverPool:
+    """Runs detail page extraction on N headless drivers in parallel.
+
+    Every worker owns one scraper instance with its own driver and cookie
+    setup. Links are fed through a bounded queue, so a lazy link source such
+    as the listing crawler is consumed only as fast as the workers keep up.
+    Extracted rows are written by a single AdvertisementWriter in the calling
+    thread. ``mode`` is either ``'thread'`` or ``'process'``.
+    """
+
+    def __init__(self, scraper_cls, scraper_kwargs: dict, workers: int = 4, mode: str = 'thread',
+                 writer: project_db.AdvertisementWriter = None, queue_size: int = 50):
+        if mode not in ('thread', 'process'):
+            raise ValueError(f"Unknown pool mode: {mode}")
+        self.scraper_cls = scraper_cls
+        self.scraper_kwargs = scraper_kwargs
+        self.workers = workers
+        self.mode = mode
+        if writer is None:
+            writer = project_db.AdvertisementWriter(on_write=Frontier(scraper_cls.webpage_name).mark_done)
+        self.writer = writer
+        self.queue_size = queue_size
+
+    def worker_kwargs(self, worker_id: int) -> dict:
+        """Scraper arguments of one worker, browser sessions can't be shared between running drivers.
+
+        A rate limiter holds a lock and can't be passed to a spawned process,
+        process workers get their share of it from worker_rate_limit instead.
+        """
+        kwargs = dict(self.scraper_kwargs)
+        if self.mode == 'process':
+            kwargs.pop('rate_limiter', None)
+        if kwargs.get('session_dir'):
+            kwargs['session_dir'] = os.path.join(kwargs['session_dir'], f'worker-{worker_id}')
+        return kwargs
+
+    def worker_rate_limit(self) -> Optional[tuple]:
+        """(rate, burst) of one process worker's own limiter, its share of the shared limiter"""
+        limiter = self.scraper_kwargs.get('rate_limiter')
+        if not limiter or self.mode != 'process':
+            return None
+        return limiter.rate / self.workers, max(1, limiter.burst // self.workers)
+
+    def _feed(self, links: Iterable[str], tasks, stop: threading.Event) -> None:
+        try:
+            for link in links:
+                if stop.is_set():
+                    break
+                tasks.put(link)
+        except Exception as e:
+            logger.error(f"Link source failed: {e}")
+        finally:
+            for _ in range(self.workers):
+                tasks.put(None)
+
+    def _stop_workers(self, tasks) -> None:
+        """Drops queued urls, they stay in flight for a resumed run, and asks every worker to stop"""
+        try:
+            while True:
+                tasks.get_nowait()
+        except queue.Empty:
+            pass
+        for _ in range(self.workers):
+            try:
+                tasks.put(None, timeout=5)
+            except queue.Full:
+                break
+
+    def run(self, links: Iterable[str]) -> tuple[int, int]:
+        if self.mode == 'process':
+            ctx = multiprocessing.get_context('spawn')
+            tasks, results, worker_cls = ctx.Queue(self.queue_size), ctx.Queue(), ctx.Process
+        else:
+            tasks, results, worker_cls = queue.Queue(self.queue_size), queue.Queue(), threading.Thread
+
+        rate_limit = self.worker_rate_limit()
+        workers = [
+            worker_cls(target=_worker, args=(self.scraper_cls, self.worker_kwargs(i), tasks, results, rate_limit),
+                       daemon=True)
+            for i in range(self.workers)
+        ]
+        for worker in workers:
+            worker.start()
+        stop = threading.Event()
+        feeder = threading.Thread(target=self._feed, args=(links, tasks, stop), daemon=True)
+        feeder.start()
+
+        running = len(workers)
+        try:
+            while running:
+                item = results.get()
+                if item == _WORKER_DONE:
+                    running -= 1
+                    continue
+                url, car_data = item
+                logger.info(car_data)
+                self.writer.add_car_data(car_data, self.scraper_cls.webpage_name, source_url=url)
+        except BaseException:
+            # Interrupted, let the workers quit their browsers instead of dying with them
+            stop.set()
+            self._stop_workers(tasks)
+            raise
+        finally:
+            for worker in workers:
+                worker.join(timeout=WORKER_JOIN_TIMEOUT)
+        return self.writer.close()
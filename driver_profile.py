@@ -0,0 +1,109 @@
+import logging
+from typing import Iterable, Optional
+
+from selenium.webdriver.chrome.options import Options
+
+logger = logging.getLogger(__name__)
+
+PROFILES = ('full', 'lean')
+
+# Resource types the scrapers never read, blocked by url pattern over DevTools
+BLOCKED_RESOURCE_PATTERNS = (
+    '*.png', '*.jpg', '*.jpeg', '*.gif', '*.webp', '*.avif', '*.svg', '*.ico', '*.bmp',
+    '*.woff', '*.woff2', '*.ttf', '*.otf', '*.eot',
+    '*.mp4', '*.webm', '*.m3u8', '*.mp3', '*.ogg',
+)
+
+# Ad, analytics and tracking hosts loaded by the detail pages
+BLOCKED_THIRD_PARTY_DOMAINS = (
+    'doubleclick.net', 'googlesyndication.com', 'googletagmanager.com', 'google-analytics.com',
+    'googleadservices.com', 'adservice.google.com', 'facebook.net', 'facebook.com', 'connect.facebook.net',
+    'criteo.com', 'criteo.net', 'adform.net', 'adnxs.com', 'hotjar.com', 'hotjar.io', 'taboola.com',
+    'outbrain.com', 'rubiconproject.com', 'pubmatic.com', 'casalemedia.com', 'amazon-adsystem.com',
+    'scorecardresearch.com', 'gemius.pl', 'tiktok.com', 'bing.com', 'clarity.ms', 'newrelic.com',
+    'nr-data.net', 'sentry.io', 'optimizely.com', 'youtube.com', 'ytimg.com',
+)
+
+LEAN_ARGUMENTS = (
+    '--blink-settings=imagesEnabled=false',
+    '--disable-extensions',
+    '--disable-background-networking',
+    '--disable-background-timer-throttling',
+    '--disable-component-update',
+    '--disable-default-apps',
+    '--disable-sync',
+    '--disable-notifications',
+    '--disable-features=Translate,MediaRouter,OptimizationHints,InterestFeedContentSuggestions,AutofillServerCommunication',
+    '--metrics-recording-only',
+    '--mute-audio',
+    '--no-first-run',
+    '--no-default-browser-check',
+)
+
+
+def _blocked_domains(allowlist: Iterable[str]) -> list:
+    allowlist = tuple(allowlist)
+    return [domain for domain in BLOCKED_THIRD_PARTY_DOMAINS
+            if not any(domain == allowed or domain.endswith('.' + allowed) or allowed.endswith(domain)
+                       for allowed in allowlist)]
+
+
+def build_options(window_size: str, profile: str = 'full', allowlist: Iterable[str] = ()) -> Options:
+    """Chrome options for a scraper driver.
+
+    The ``lean`` profile turns off images and Chrome background features and
+    makes blocked third-party hosts unresolvable for every tab of the browser.
+    """
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown driver profile: {profile}")
+    options = Options()
+    options.add_argument("--headless")
+    options.add_argument("--disable-gpu")
+    options.add_argument(f"window-size={window_size}")
+    if profile == 'lean':
+        for argument in LEAN_ARGUMENTS:
+            options.add_argument(argument)
+        rules = ', '.join(f'MAP {domain} ~NOTFOUND, MAP *.{domain} ~NOTFOUND' for domain in _blocked_domains(allowlist))
+        if rules:
+            options.add_argument(f'--host-resolver-rules={rules}')
+        options.add_experimental_option('prefs', {
+            'profile.managed_default_content_settings.images': 2,
+            'profile.managed_default_content_settings.media_stream': 2,
+            'profile.default_content_setting_values.notifications': 2,
+        })
+    return options
+
+
+def apply_request_blocking(driver, allowlist: Iterable[str] = ()) -> None:
+    """Blocks image, font and media requests and third-party hosts through DevTools.
+
+    DevTools blocking applies to the tab the driver is attached to, which is
+    where pool workers load every page. Tabs opened later need their own
+    call, see open_tab.
+    """
+    blocked_domains = _blocked_domains(allowlist)
+    patterns = list(BLOCKED_RESOURCE_PATTERNS)
+    patterns += [f'*://*.{domain}/*' for domain in blocked_domains]
+    patterns += [f'*://{domain}/*' for domain in blocked_domains]
+    try:
+        driver.execute_cdp_cmd('Network.enable', {})
+        driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': patterns})
+    except Exception as e:
+        logger.info(f"Could not enable request blocking: {e}")
+
+
+def open_tab(driver, url: str, allowlist: Optional[Iterable[str]] = None) -> list:
+    """Starts loading url in a new tab without waiting for it, returns the new window handles.
+
+    With an allowlist the tab is opened blank and gets apply_request_blocking
+    before it navigates, so it loads no fonts and media either. The driver
+    is then left on the new tab.
+    """
+    known = set(driver.window_handles)
+    if allowlist is None:
+        driver.execute_script("window.open(arguments[0]);", url)
+        return [window for window in driver.window_handles if window not in known]
+    driver.switch_to.new_window('tab')
+    apply_request_blocking(driver, allowlist)
+    driver.execute_script("window.location.href = arguments[0];", url)
+    return [driver.current_window_handle]
@@ -0,0 +1,180 @@
+import argparse
+import csv
+import json
+import os
+import sys
+from datetime import date
+from typing import Iterator, Optional
+
+from sqlalchemy import select
+
+from project_db import Advertisement, Session, Webpage
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+EXPORT_CHUNK_SIZE = 10_000
+FORMATS = ('parquet', 'csv', 'ndjson')
+
+# Exported columns and their parquet types, the order is part of the file format
+COLUMNS = (
+    ('id', 'int64'),
+    ('url', 'string'),
+    ('site', 'string'),
+    ('brand', 'string'),
+    ('model_version', 'string'),
+    ('year', 'string'),
+    ('price', 'int64'),
+    ('mileage', 'string'),
+    ('gearbox', 'string'),
+    ('fuel_type', 'string'),
+    ('engine_power', 'string'),
+    ('location', 'string'),
+    ('date_added', 'string'),
+    ('year_value', 'int32'),
+    ('mileage_km', 'int64'),
+    ('engine_power_kw', 'int32'),
+    ('added_on', 'date32'),
+)
+
+
+def parquet_schema():
+    return pyarrow.schema([(name, getattr(pyarrow, type_name)()) for name, type_name in COLUMNS])
+
+
+def iter_chunks(after_id: int = 0, since: Optional[date] = None,
+                chunk_size: int = EXPORT_CHUNK_SIZE) -> Iterator[list]:
+    """Streams advertisements in id order as lists of at most chunk_size row dicts.
+
+    Rows are fetched through one cursor ``chunk_size`` at a time, so memory
+    use does not depend on the size of the table.
+    """
+    columns = [Webpage.page_name.label('site') if name == 'site' else getattr(Advertisement, name)
+               for name, _ in COLUMNS]
+    query = (
+        select(*columns)
+        .join(Webpage, Advertisement.webpage_id == Webpage.id)
+        .where(Advertisement.id > after_id)
+        .order_by(Advertisement.id)
+        .execution_options(yield_per=chunk_size)
+    )
+    if since is not None:
+        query = query.where(Advertisement.added_on >= since)
+    with Session() as session:
+        for partition in session.execute(query).mappings().partitions():
+            yield [dict(row) for row in partition]
+
+
+class ParquetExport:
+    def __init__(self, path: str):
+        if pyarrow is None:
+            raise RuntimeError('parquet export needs pyarrow installed')
+        self.schema = parquet_schema()
+        self.writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+
+    def write(self, rows: list) -> None:
+        self.writer.write_table(pyarrow.Table.from_pylist(rows, schema=self.schema))
+
+    def close(self) -> None:
+        self.writer.close()
+
+
+class CsvExport:
+    def __init__(self, path: str):
+        self.f = open(path, 'w', newline='', encoding='utf-8')
+        self.writer = csv.DictWriter(self.f, fieldnames=[name for name, _ in COLUMNS])
+        self.writer.writeheader()
+
+    def write(self, rows: list) -> None:
+        self.writer.writerows(rows)
+
+    def close(self) -> None:
+        self.f.close()
+
+
+class NdjsonExport:
+    def __init__(self, path: str):
+        self.f = open(path, 'w', encoding='utf-8')
+
+    def write(self, rows: list) -> None:
+        self.f.writelines(json.dumps(row, ensure_ascii=False, default=str) + '\n' for row in rows)
+
+    def close(self) -> None:
+        self.f.close()
+
+
+EXPORTERS = {
+    'parquet': ParquetExport,
+    'csv': CsvExport,
+    'ndjson': NdjsonExport,
+}
+
+
+def export(path: str, fmt: Optional[str] = None, after_id: int = 0, since: Optional[date] = None,
+           chunk_size: int = EXPORT_CHUNK_SIZE) -> tuple[int, int]:
+    """Writes advertisements with an id above after_id to path, returns (rows written, last exported id).
+
+    The file is written under a temporary name and moved into place when
+    complete, an interrupted export leaves no partial file behind.
+    """
+    fmt = fmt or os.path.splitext(path)[1].lstrip('.')
+    if fmt not in EXPORTERS:
+        raise ValueError(f"Unknown export format: {fmt}")
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    exporter = EXPORTERS[fmt](tmp_path)
+    written, last_id = 0, after_id
+    try:
+        for rows in iter_chunks(after_id, since, chunk_size):
+            exporter.write(rows)
+            written += len(rows)
+            last_id = rows[-1]['id']
+            print(f'exported {written} advertisements')
+        exporter.close()
+    except BaseException:
+        exporter.close()
+        os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, path)
+    return written, last_id
+
+
+def read_watermark(state_file: str) -> int:
+    try:
+        with open(state_file, encoding='utf-8') as f:
+            return json.load(f)['last_id']
+    except FileNotFoundError:
+        return 0
+
+
+def write_watermark(state_file: str, last_id: int) -> None:
+    with open(state_file, 'w', encoding='utf-8') as f:
+        json.dump(dict(last_id=last_id), f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export advertisements to parquet, csv or ndjson')
+    parser.add_argument('output', help='file to write, the format is taken from its extension')
+    parser.add_argument('--format', choices=FORMATS, default=None)
+    parser.add_argument('--after-id', type=int, default=0, help='export only advertisements with a higher id')
+    parser.add_argument('--since', type=date.fromisoformat, default=None, metavar='YYYY-MM-DD',
+                        help='export only advertisements added on or after this date')
+    parser.add_argument('--state', metavar='FILE', default=None,
+                        help='continue after the last id exported with this state file and update it')
+    parser.add_argument('--chunk-size', type=int, default=EXPORT_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    after_id = max(args.after_id, read_watermark(args.state)) if args.state else args.after_id
+    try:
+        written, last_id = export(args.output, args.format, after_id, args.since, args.chunk_size)
+    except (ValueError, RuntimeError) as e:
+        print(e)
+        sys.exit(1)
+    if args.state:
+        write_watermark(args.state, last_id)
+    print(f'exported {written} advertisements to {args.output}, last id {last_id}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+import time
+from itertools import islice
+from typing import Iterable, Iterator
+
+from sqlalchemy import Index, Integer, String, delete, func, select, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Mapped, mapped_column
+
+import project_db
+from project_db import Base, Session
+
+PENDING = 'pending'
+IN_FLIGHT = 'in_flight'
+DONE = 'done'
+FAILED = 'failed'
+
+MAX_ATTEMPTS = 3
+
+
+class FrontierUrl(Base):
+    __tablename__ = "frontier"
+    __table_args__ = (
+        Index('ix_frontier_site_state', 'site', 'state'),
+        {'sqlite_autoincrement': True},
+    )
+
+    id: Mapped[int] = mapped_column(init=False, primary_key=True, autoincrement=True)
+    site: Mapped[str] = mapped_column(String(50), nullable=False)
+    url: Mapped[str] = mapped_column(String(300), nullable=False, unique=True)
+    state: Mapped[str] = mapped_column(String(20), nullable=False, default=PENDING)
+    attempts: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    updated_at: Mapped[int] = mapped_column(Integer, nullable=False, default=0, comment='unix time of the last change')
+    error: Mapped[str] = mapped_column(String(300), nullable=True, default=None)
+
+
+Base.metadata.create_all(bind=project_db.engine, tables=[FrontierUrl.__table__])
+
+
+class Frontier:
+    """Detail urls of one site's crawl with their state, kept in the database.
+
+    Urls are added as pending and handed out by ``claim``, which moves them
+    to in-flight in a single UPDATE ... RETURNING, so concurrent workers and
+    processes never get the same url. Failed urls go back to pending until
+    they used up ``max_attempts``. Urls are marked done by the
+    AdvertisementWriter in the transaction that stores their rows, so after a
+    crash ``recover`` only has to return in-flight urls to pending for a
+    resumed run to pick up where the last one stopped.
+    """
+
+    def __init__(self, site: str, max_attempts: int = MAX_ATTEMPTS):
+        self.site = site
+        self.max_attempts = max_attempts
+
+    def _add(self, session, urls: Iterable[str]) -> None:
+        rows = [dict(site=self.site, url=url, state=PENDING, attempts=0, updated_at=int(time.time()))
+                for url in urls]
+        if rows:
+            session.execute(sqlite_insert(FrontierUrl).on_conflict_do_nothing(index_elements=['url']), rows)
+
+    def _claim(self, session, limit: int) -> list:
+        oldest = (
+            select(FrontierUrl.id)
+            .where(FrontierUrl.site == self.site, FrontierUrl.state == PENDING)
+            .order_by(FrontierUrl.id)
+            .limit(limit)
+        )
+        return list(session.scalars(
+            update(FrontierUrl)
+            .where(FrontierUrl.id.in_(oldest.correlate(None)))
+            .values(state=IN_FLIGHT, attempts=FrontierUrl.attempts + 1, updated_at=int(time.time()))
+            .returning(FrontierUrl.url)
+        ))
+
+    def add(self, urls: Iterable[str]) -> None:
+        """Adds urls as pending, urls the frontier already knows keep their state"""
+        with Session() as session:
+            with session.begin():
+                self._add(session, urls)
+
+    def claim(self, limit: int = 1) -> list:
+        """Moves up to limit of the oldest pending urls to in-flight and returns them"""
+        with Session() as session:
+            with session.begin():
+                return self._claim(session, limit)
+
+    def claimed(self, links: Iterable[str], chunk_size: int = 20) -> Iterator[str]:
+        """Adds a lazy link source to the frontier and yields claimed urls as it goes.
+
+        Links are added and as many urls claimed, oldest first, in one
+        transaction per chunk, so urls left pending by an earlier run are
+        handed out before new ones. Once the source is exhausted the
+        remaining pending urls are drained.
+        """
+        links = iter(links)
+        while chunk := list(islice(links, chunk_size)):
+            with Session() as session:
+                with session.begin():
+                    self._add(session, chunk)
+                    urls = self._claim(session, len(chunk))
+            yield from urls
+        while urls := self.claim(chunk_size):
+            yield from urls
+
+    def mark_done(self, session, urls: Iterable[str]) -> None:
+        """Marks urls done in the caller's transaction, AdvertisementWriter's on_write for stored rows"""
+        urls = list(urls)
+        if urls:
+            session.execute(
+                update(FrontierUrl)
+                .where(FrontierUrl.url.in_(urls))
+                .values(state=DONE, error=None, updated_at=int(time.time()))
+            )
+
+    def done(self, urls: Iterable[str]) -> None:
+        with Session() as session:
+            with session.begin():
+                self.mark_done(session, urls)
+
+    def failed(self, url: str, error: str = '', retry: bool = True) -> None:
+        """Returns url to pending for another attempt, or marks it failed after max_attempts"""
+        state = func.iif(FrontierUrl.attempts >= self.max_attempts, FAILED, PENDING) if retry else FAILED
+        with Session() as session:
+            with session.begin():
+                session.execute(
+                    update(FrontierUrl)
+                    .where(FrontierUrl.url == url)
+                    .values(state=state,
+                            error=error[:300], updated_at=int(time.time()))
+                )
+
+    def recover(self) -> int:
+        """Returns urls of an interrupted run to pending, returns their number"""
+        with Session() as session:
+            with session.begin():
+                result = session.execute(
+                    update(FrontierUrl)
+                    .where(FrontierUrl.site == self.site, FrontierUrl.state == IN_FLIGHT)
+                    .values(state=PENDING, updated_at=int(time.time()))
+                )
+                return result.rowcount
+
+    def reset(self) -> None:
+        """Forgets all urls of the site, for a run starting from scratch"""
+        with Session() as session:
+            with session.begin():
+                session.execute(delete(FrontierUrl).where(FrontierUrl.site == self.site))
+
+    def counts(self) -> dict:
+        with Session() as session:
+            return dict(session.execute(
+                select(FrontierUrl.state, func.count(FrontierUrl.id))
+                .where(FrontierUrl.site == self.site)
+                .group_by(FrontierUrl.state)
+            ).all())
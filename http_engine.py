@@ -0,0 +1,116 @@
+import asyncio
+import logging
+import pickle
+from typing import Callable, Iterable, Optional
+
+import aiohttp
+import lxml.html
+
+from metrics import REGISTRY, STAGE_METRIC
+from rate_limit import RateLimiter
+
+logger = logging.getLogger(__name__)
+
+USER_AGENT = ('Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 '
+              '(KHTML, like Gecko) Chrome/120.0 Safari/537.36')
+
+
+def normalize_text(text: str) -> str:
+    return ' '.join(text.split())
+
+
+def parse_fields(html: str, fields: dict) -> dict:
+    """Evaluates the field xpaths on html, returns the text of the first match or None"""
+    tree = lxml.html.fromstring(html)
+    values = {}
+    for name, xpath in fields.items():
+        nodes = tree.xpath(xpath)
+        text = normalize_text(nodes[0].text_content()) if nodes else ''
+        values[name] = text or None
+    return values
+
+
+def parse_car_data(site, url: str, html: str):
+    """Builds the site's CarData from a detail page, None if a required field is missing"""
+    values = parse_fields(html, site.FIELDS)
+    missing = [name for name in site.REQUIRED_FIELDS if values.get(name) is None]
+    if missing:
+        logger.info(f"Missing {missing} in {url}")
+        return None
+    try:
+        return site.build_car_data(url, values)
+    except ValueError as e:
+        logger.info(f"Could not parse {url}: {e}")
+        return None
+
+
+def load_cookie_jar(cookies_file: str) -> dict:
+    """Reads a pickled selenium cookie list into a name -> value dict"""
+    try:
+        with open(cookies_file, 'rb') as f:
+            return {cookie['name']: cookie['value'] for cookie in pickle.load(f)}
+    except Exception as e:
+        logger.info(f"No cookies for http engine: {e}")
+        return {}
+
+
+class HttpEngine:
+    """Fetches detail pages without a browser and parses them with lxml.
+
+    ``site`` is a scraper module exposing FIELDS, REQUIRED_FIELDS and
+    build_car_data. ``on_page`` is called with (url, html) of every fetched
+    page. ``rate_limiter`` is acquired before every request. Pages that fail
+    to download or lack a required field are returned separately so the
+    caller can retry them with Selenium.
+    """
+
+    def __init__(self, site, concurrency: int = 16, cookies: Optional[dict] = None, timeout: float = 30,
+                 on_page: Optional[Callable[[str, str], None]] = None, rate_limiter: Optional[RateLimiter] = None):
+        self.site = site
+        self.concurrency = concurrency
+        self.cookies = cookies or {}
+        self.timeout = timeout
+        self.on_page = on_page
+        self.rate_limiter = rate_limiter
+
+    def extract(self, links: Iterable[str]) -> tuple[list, list]:
+        """Returns (car data list, links needing the browser fallback)"""
+        return asyncio.run(self.extract_async(list(links)))
+
+    async def extract_async(self, links: list) -> tuple[list, list]:
+        connector = aiohttp.TCPConnector(limit=self.concurrency, limit_per_host=self.concurrency)
+        async with aiohttp.ClientSession(
+                connector=connector,
+                cookies=self.cookies,
+                headers={'User-Agent': USER_AGENT},
+                timeout=aiohttp.ClientTimeout(total=self.timeout)) as session:
+            results = await asyncio.gather(*(self._extract_one(session, link) for link in links))
+
+        cars, fallback = [], []
+        for link, car_data in zip(links, results):
+            if car_data is None:
+                fallback.append(link)
+            else:
+                cars.append(car_data)
+        return cars, fallback
+
+    async def fetch(self, session: aiohttp.ClientSession, url: str) -> tuple[str, str]:
+        if self.rate_limiter:
+            await asyncio.to_thread(self.rate_limiter.acquire)
+        with REGISTRY.timer(STAGE_METRIC, stage='http_fetch'):
+            async with session.get(url) as response:
+                response.raise_for_status()
+                return str(response.url), await response.text()
+
+    async def _extract_one(self, session: aiohttp.ClientSession, url: str):
+        try:
+            final_url, html = await self.fetch(session, url)
+        except Exception as e:
+            logger.info(f"Http fetch failed for {url}: {e}")
+            return None
+        if self.on_page:
+            self.on_page(final_url, html)
+        return self.parse(final_url, html)
+
+    def parse(self, url: str, html: str):
+        return parse_car_data(self.site, url, html)
@@ -0,0 +1,89 @@
+import logging
+from itertools import islice
+from typing import Iterable, Iterator, Optional
+
+from selenium.common import NoSuchElementException, TimeoutException
+from selenium.webdriver.common.by import By
+
+from metrics import REGISTRY, STAGE_METRIC
+
+logger = logging.getLogger(__name__)
+
+
+def iter_listing_links(scraper, max_pages: int = 1, max_items: Optional[int] = None) -> Iterator[str]:
+    """Follows the result pages of a scraper's search and yields detail links as they are found.
+
+    The scraper driver is expected to be on the first result page. Links of a
+    page are read before any of them is yielded, so consumers may use other
+    tabs of the same driver between items.
+    """
+    count = 0
+    for page in range(1, max_pages + 1):
+        with REGISTRY.timer(STAGE_METRIC, stage='listing_page', site=scraper.webpage_name):
+            if page > 1:
+                scraper.driver.switch_to.window(scraper.base_window)
+                scraper.throttle()
+                scraper.driver.get(scraper.page_url(page))
+            try:
+                items = scraper.readiness.elements(scraper.driver, scraper.listing_ready, 'listing')
+            except TimeoutException:
+                logger.info(f"No listing items on page {page}, stopping")
+                return
+
+            links = []
+            for item in items:
+                try:
+                    links.append(item.find_element(By.CSS_SELECTOR, 'a').get_attribute('href'))
+                except NoSuchElementException:
+                    continue
+        logger.info(f"Listing page {page}: {len(links)} links")
+
+        for link in links:
+            yield link
+            count += 1
+            if max_items is not None and count >= max_items:
+                return
+
+
+class IncrementalFilter:
+    """Filters a newest-first link stream down to unseen links and stops early.
+
+    The stream ends at the previous run's high-water mark or after
+    ``known_run`` consecutive already-known links. The high-water mark is
+    ignored in first position, where sites tend to pin promoted listings.
+    After a complete crawl ``newest`` holds the first link of this run after
+    that position, as a pinned listing would never be met again as a mark.
+    """
+
+    def __init__(self, url_index, high_water_mark: Optional[str] = None, known_run: int = 10):
+        self.url_index = url_index
+        self.high_water_mark = high_water_mark
+        self.known_run = known_run
+        self.newest = None
+        self.stopped_early = False
+
+    def __call__(self, links: Iterable[str]) -> Iterator[str]:
+        run = 0
+        for position, link in enumerate(links):
+            if self.newest is None and position > 0:
+                self.newest = link
+            if position > 0 and link == self.high_water_mark:
+                logger.info(f"Reached high-water mark after {position} listings")
+                self.stopped_early = True
+                return
+            if link in self.url_index:
+                run += 1
+                if self.known_run and run >= self.known_run:
+                    logger.info(f"{run} known listings in a row, stopping after {position + 1} listings")
+                    self.stopped_early = True
+                    return
+                continue
+            run = 0
+            self.url_index.add(link)
+            yield link
+
+
+def chunked(iterable: Iterable, size: int) -> Iterator[list]:
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
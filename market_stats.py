@@ -0,0 +1,253 @@
+import math
+from collections import defaultdict
+from typing import Optional, Sequence
+
+from sqlalchemy import ForeignKey, Integer, String, delete, func, select, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Mapped, mapped_column
+
+import project_db
+from project_db import Advertisement, Base, Session, Webpage
+
+# Prices are counted in log-spaced buckets about 5 % wide, percentiles read
+# from them are accurate to roughly that width.
+BUCKET_BASE = 1.05
+DEFAULT_PERCENTILES = (0.1, 0.25, 0.5, 0.75, 0.9)
+REBUILD_CHUNK_SIZE = 5000
+
+# Missing group attributes are stored as these values so they take part in the primary key
+NO_MODEL = ''
+NO_YEAR = 0
+
+
+class PriceStats(Base):
+    __tablename__ = "price_stats"
+
+    webpage_id: Mapped[int] = mapped_column(ForeignKey('webpages.id'), primary_key=True)
+    brand: Mapped[str] = mapped_column(String(100), primary_key=True)
+    model_version: Mapped[str] = mapped_column(String(100), primary_key=True)
+    year_value: Mapped[int] = mapped_column(Integer, primary_key=True)
+    count: Mapped[int] = mapped_column(Integer, nullable=False)
+    price_sum: Mapped[int] = mapped_column(Integer, nullable=False)
+    price_min: Mapped[int] = mapped_column(Integer, nullable=False)
+    price_max: Mapped[int] = mapped_column(Integer, nullable=False)
+
+
+class PriceBucket(Base):
+    __tablename__ = "price_stat_buckets"
+
+    webpage_id: Mapped[int] = mapped_column(ForeignKey('webpages.id'), primary_key=True)
+    brand: Mapped[str] = mapped_column(String(100), primary_key=True)
+    model_version: Mapped[str] = mapped_column(String(100), primary_key=True)
+    year_value: Mapped[int] = mapped_column(Integer, primary_key=True)
+    bucket: Mapped[int] = mapped_column(Integer, primary_key=True)
+    count: Mapped[int] = mapped_column(Integer, nullable=False)
+
+
+Base.metadata.create_all(bind=project_db.engine, tables=[PriceStats.__table__, PriceBucket.__table__])
+
+
+def price_bucket(price: int) -> int:
+    return math.floor(math.log(max(price, 1), BUCKET_BASE))
+
+
+def bucket_price(bucket: int) -> float:
+    """Representative price of a bucket, its geometric midpoint"""
+    return BUCKET_BASE ** (bucket + 0.5)
+
+
+def _group_key(row) -> tuple:
+    return (row['webpage_id'], row['brand'], row['model_version'] or NO_MODEL, row['year_value'] or NO_YEAR)
+
+
+def update_stats(session, rows: Sequence[dict]) -> None:
+    """Adds advertisement rows to the summary tables, in the caller's transaction"""
+    groups = {}
+    buckets = defaultdict(int)
+    for row in rows:
+        price = row.get('price')
+        if price is None:
+            continue
+        key = _group_key(row)
+        count, total, low, high = groups.get(key, (0, 0, price, price))
+        groups[key] = (count + 1, total + price, min(low, price), max(high, price))
+        buckets[key + (price_bucket(price),)] += 1
+    if not groups:
+        return
+
+    key_names = ('webpage_id', 'brand', 'model_version', 'year_value')
+    stats_stmt = sqlite_insert(PriceStats)
+    stats_stmt = stats_stmt.on_conflict_do_update(
+        index_elements=list(key_names),
+        set_=dict(
+            count=PriceStats.count + stats_stmt.excluded.count,
+            price_sum=PriceStats.price_sum + stats_stmt.excluded.price_sum,
+            price_min=func.min(PriceStats.price_min, stats_stmt.excluded.price_min),
+            price_max=func.max(PriceStats.price_max, stats_stmt.excluded.price_max),
+        )
+    )
+    session.execute(stats_stmt, [
+        dict(zip(key_names, key), count=count, price_sum=total, price_min=low, price_max=high)
+        for key, (count, total, low, high) in groups.items()
+    ])
+
+    bucket_stmt = sqlite_insert(PriceBucket)
+    bucket_stmt = bucket_stmt.on_conflict_do_update(
+        index_elements=list(key_names) + ['bucket'],
+        set_=dict(count=PriceBucket.count + bucket_stmt.excluded.count)
+    )
+    session.execute(bucket_stmt, [
+        dict(zip(key_names + ('bucket',), key), count=count) for key, count in buckets.items()
+    ])
+
+
+def _key_filter(model, key: tuple) -> list:
+    webpage_id, brand, model_version, year_value = key
+    return [model.webpage_id == webpage_id, model.brand == brand, model.model_version == model_version,
+            model.year_value == year_value]
+
+
+def remove_stats(session, rows: Sequence[dict]) -> None:
+    """Takes advertisement rows out of the summary tables, in the caller's transaction.
+
+    Call it after the advertisements themselves were changed: groups whose
+    lowest or highest price was removed get them recomputed from the
+    advertisements left in the group, empty groups are deleted.
+    """
+    groups = {}
+    buckets = defaultdict(int)
+    for row in rows:
+        price = row.get('price')
+        if price is None:
+            continue
+        key = _group_key(row)
+        count, total, prices = groups.get(key, (0, 0, frozenset()))
+        groups[key] = (count + 1, total + price, prices | {price})
+        buckets[key + (price_bucket(price),)] += 1
+
+    for key, (count, total, prices) in groups.items():
+        stats = session.execute(
+            update(PriceStats)
+            .where(*_key_filter(PriceStats, key))
+            .values(count=PriceStats.count - count, price_sum=PriceStats.price_sum - total)
+            .returning(PriceStats.count, PriceStats.price_min, PriceStats.price_max)
+        ).first()
+        if stats is None:
+            continue
+        if stats.count <= 0:
+            session.execute(delete(PriceStats).where(*_key_filter(PriceStats, key)))
+        elif stats.price_min in prices or stats.price_max in prices:
+            webpage_id, brand, model_version, year_value = key
+            low, high = session.execute(
+                select(func.min(Advertisement.price), func.max(Advertisement.price))
+                .where(Advertisement.webpage_id == webpage_id, Advertisement.brand == brand,
+                       func.coalesce(Advertisement.model_version, NO_MODEL) == model_version,
+                       func.coalesce(Advertisement.year_value, NO_YEAR) == year_value,
+                       Advertisement.price.is_not(None))
+            ).one()
+            if low is not None:
+                session.execute(update(PriceStats).where(*_key_filter(PriceStats, key))
+                                .values(price_min=low, price_max=high))
+
+    for key, count in buckets.items():
+        bucket_filter = _key_filter(PriceBucket, key[:4]) + [PriceBucket.bucket == key[4]]
+        session.execute(update(PriceBucket).where(*bucket_filter).values(count=PriceBucket.count - count))
+        session.execute(delete(PriceBucket).where(*bucket_filter, PriceBucket.count <= 0))
+
+
+def replace_stats(session, old_rows: Sequence[dict], new_rows: Sequence[dict]) -> None:
+    """Update hook, moves overwritten advertisements from their old group and price to the new ones.
+
+    old_rows and new_rows are pairs in the same order, pairs with an
+    unchanged group and price are skipped.
+    """
+    changed = [(old, new) for old, new in zip(old_rows, new_rows)
+               if (_group_key(old), old.get('price')) != (_group_key(new), new.get('price'))]
+    if not changed:
+        return
+    remove_stats(session, [old for old, _ in changed])
+    update_stats(session, [new for _, new in changed])
+
+
+def _filters(model, brand, model_version, year, webpage_name) -> list:
+    filters = []
+    if brand is not None:
+        filters.append(model.brand == brand)
+    if model_version is not None:
+        filters.append(model.model_version == model_version)
+    if year is not None:
+        filters.append(model.year_value == year)
+    if webpage_name is not None:
+        filters.append(model.webpage_id == select(Webpage.id).filter_by(page_name=webpage_name).scalar_subquery())
+    return filters
+
+
+def group_stats(brand: Optional[str] = None, model_version: Optional[str] = None, year: Optional[int] = None,
+                webpage_name: Optional[str] = None) -> list:
+    """Per group counts and prices for the groups matching the filters"""
+    with Session() as session:
+        rows = session.scalars(
+            select(PriceStats).where(*_filters(PriceStats, brand, model_version, year, webpage_name))
+        ).all()
+        return [dict(webpage_id=row.webpage_id,
+                     brand=row.brand,
+                     model_version=row.model_version or None,
+                     year=row.year_value or None,
+                     count=row.count,
+                     mean=row.price_sum / row.count,
+                     min=row.price_min,
+                     max=row.price_max) for row in rows]
+
+
+def price_summary(brand: Optional[str] = None, model_version: Optional[str] = None, year: Optional[int] = None,
+                  webpage_name: Optional[str] = None,
+                  percentiles: Sequence[float] = DEFAULT_PERCENTILES) -> Optional[dict]:
+    """Count, mean, min, max and approximate percentiles over all matching groups"""
+    with Session() as session:
+        count, total, low, high = session.execute(
+            select(func.sum(PriceStats.count), func.sum(PriceStats.price_sum),
+                   func.min(PriceStats.price_min), func.max(PriceStats.price_max))
+            .where(*_filters(PriceStats, brand, model_version, year, webpage_name))
+        ).one()
+        if not count:
+            return None
+        histogram = session.execute(
+            select(PriceBucket.bucket, func.sum(PriceBucket.count))
+            .where(*_filters(PriceBucket, brand, model_version, year, webpage_name))
+            .group_by(PriceBucket.bucket)
+            .order_by(PriceBucket.bucket)
+        ).all()
+
+    summary = dict(count=count, mean=total / count, min=low, max=high, percentiles={})
+    for percentile in percentiles:
+        rank = percentile * count
+        seen = 0
+        for bucket, bucket_count in histogram:
+            seen += bucket_count
+            if seen >= rank:
+                summary['percentiles'][percentile] = min(max(round(bucket_price(bucket)), low), high)
+                break
+    return summary
+
+
+def rebuild(chunk_size: int = REBUILD_CHUNK_SIZE) -> None:
+    """Recomputes the summary tables from the advertisements table"""
+    with Session() as session:
+        with session.begin():
+            session.query(PriceStats).delete()
+            session.query(PriceBucket).delete()
+    last_id = 0
+    while True:
+        with Session() as session:
+            with session.begin():
+                rows = session.execute(
+                    select(Advertisement.id, Advertisement.webpage_id, Advertisement.brand,
+                           Advertisement.model_version, Advertisement.year_value, Advertisement.price)
+                    .where(Advertisement.id > last_id)
+                    .order_by(Advertisement.id)
+                    .limit(chunk_size)
+                ).mappings().all()
+                if not rows:
+                    break
+                update_stats(session, rows)
+        last_id = rows[-1]['id']
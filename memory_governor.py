@@ -0,0 +1,92 @@
+import logging
+import time
+from typing import Optional
+
+from metrics import REGISTRY
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+logger = logging.getLogger(__name__)
+
+RSS_METRIC = 'carscraper_browser_rss_mb'
+RECYCLE_METRIC = 'carscraper_driver_recycles_total'
+
+REGISTRY.set_buckets(RSS_METRIC, (250, 500, 750, 1000, 1500, 2000, 3000, 4000, 6000, 8000))
+
+
+def driver_rss(driver) -> Optional[int]:
+    """Resident memory in bytes of chromedriver and every browser process below it, None if unknown"""
+    if psutil is None:
+        return None
+    try:
+        process = psutil.Process(driver.service.process.pid)
+        processes = [process] + process.children(recursive=True)
+    except (AttributeError, psutil.Error):
+        return None
+    rss = 0
+    for child in processes:
+        try:
+            rss += child.memory_info().rss
+        except psutil.Error:
+            continue
+    return rss
+
+
+class MemoryGovernor:
+    """Decides when a long running driver should be replaced by a fresh one.
+
+    A driver is recycled after ``max_pages`` detail pages, or once the
+    resident memory of its process tree passes ``max_rss_mb``. Memory is
+    sampled every ``sample_every`` pages, without psutil only the page limit
+    applies. Samples and recycle events are kept for tuning the limits and
+    exported as the carscraper_browser_rss_mb histogram and the
+    carscraper_driver_recycles_total counter.
+    """
+
+    def __init__(self, site: str = '', max_pages: Optional[int] = 500, max_rss_mb: Optional[float] = 1500,
+                 sample_every: int = 10, history: int = 100):
+        self.site = site
+        self.max_pages = max_pages
+        self.max_rss_mb = max_rss_mb
+        self.sample_every = sample_every
+        self.history = history
+        self.pages = 0
+        self.last_rss_mb = None
+        self.samples = []
+        self.events = []
+
+    def pages_done(self, driver, count: int = 1) -> Optional[str]:
+        """Counts pages handled by driver, returns the reason to recycle it or None"""
+        previous, self.pages = self.pages, self.pages + count
+        if self.max_pages and self.pages >= self.max_pages:
+            return 'pages'
+        if self.max_rss_mb and previous // self.sample_every != self.pages // self.sample_every:
+            rss = driver_rss(driver)
+            if rss is not None:
+                rss_mb = self.last_rss_mb = rss / 1024 / 1024
+                REGISTRY.observe(RSS_METRIC, rss_mb, site=self.site)
+                self.samples = (self.samples + [(time.time(), self.pages, round(rss_mb, 1))])[-self.history:]
+                if rss_mb >= self.max_rss_mb:
+                    return 'memory'
+        return None
+
+    def recycled(self, reason: str) -> None:
+        rss_mb = self.samples[-1][2] if self.samples else None
+        REGISTRY.inc(RECYCLE_METRIC, site=self.site, reason=reason)
+        event = dict(time=time.time(), reason=reason, pages=self.pages, rss_mb=rss_mb)
+        self.events = (self.events + [event])[-self.history:]
+        logger.info(f"Recycled {self.site} driver after {self.pages} pages ({reason}, last rss {rss_mb} MB)")
+        self.pages = 0
+        self.last_rss_mb = None
+
+    def memory_pressure(self, headroom: float = 0.8) -> bool:
+        """True while the current driver's last sample used more than headroom of max_rss_mb"""
+        return bool(self.max_rss_mb and self.last_rss_mb and self.last_rss_mb >= self.max_rss_mb * headroom)
+
+    def report(self) -> dict:
+        return dict(recycles=len(self.events), pages_since_recycle=self.pages,
+                    last_rss_mb=self.samples[-1][2] if self.samples else None,
+                    peak_rss_mb=max((sample[2] for sample in self.samples), default=None))
@@ -0,0 +1,179 @@
+import bisect
+import functools
+import json
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+# Upper bounds in seconds, from a single WebDriver call up to a stuck page load
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+STAGE_METRIC = 'carscraper_stage_seconds'
+
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(key: tuple, extra: tuple = ()) -> str:
+    pairs = key + extra
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in pairs) + '}'
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, fraction: float) -> Optional[float]:
+        """Upper bound of the bucket holding the given quantile"""
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        for bound, count in zip(self.buckets + (self.max,), self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+
+class Registry:
+    """Thread-safe counters and histograms with Prometheus text and JSON export"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._buckets = {}
+        self.started = time.time()
+
+    def set_buckets(self, name: str, buckets) -> None:
+        """Bucket bounds for a histogram not measured in seconds, set before its first observation"""
+        with self._lock:
+            self._buckets[name] = tuple(buckets)
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(self._buckets.get(name, DEFAULT_BUCKETS))
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+            self.started = time.time()
+
+    def prometheus_text(self) -> str:
+        lines = []
+        with self._lock:
+            for name in sorted({name for name, _ in self._counters}):
+                lines.append(f'# TYPE {name} counter')
+                for (metric, key), value in sorted(self._counters.items()):
+                    if metric == name:
+                        lines.append(f'{name}{_format_labels(key)} {value}')
+            for name in sorted({name for name, _ in self._histograms}):
+                lines.append(f'# TYPE {name} histogram')
+                for (metric, key), histogram in sorted(self._histograms.items(), key=lambda item: item[0]):
+                    if metric != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        cumulative += count
+                        lines.append(f'{name}_bucket{_format_labels(key, (("le", bound),))} {cumulative}')
+                    lines.append(f'{name}_bucket{_format_labels(key, (("le", "+Inf"),))} {histogram.count}')
+                    lines.append(f'{name}_sum{_format_labels(key)} {histogram.sum}')
+                    lines.append(f'{name}_count{_format_labels(key)} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+    def summary(self) -> dict:
+        """Per-run summary: counter values and count/sum/mean/p50/p95/max per histogram"""
+        with self._lock:
+            counters = [dict(name=name, labels=dict(key), value=value)
+                        for (name, key), value in sorted(self._counters.items())]
+            histograms = [dict(name=name, labels=dict(key), count=h.count, sum=round(h.sum, 6),
+                               mean=round(h.sum / h.count, 6) if h.count else None,
+                               p50=h.quantile(0.5), p95=h.quantile(0.95), max=round(h.max, 6))
+                          for (name, key), h in sorted(self._histograms.items(), key=lambda item: item[0])]
+        return dict(started=self.started, duration=round(time.time() - self.started, 3),
+                    counters=counters, histograms=histograms)
+
+    def write_prometheus(self, path: str) -> None:
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(self.prometheus_text())
+
+    def write_json(self, path: str) -> None:
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.summary(), f, indent=2)
+
+    def export(self, json_path: Optional[str] = None, prometheus_path: Optional[str] = None) -> None:
+        if json_path:
+            self.write_json(json_path)
+        if prometheus_path:
+            self.write_prometheus(prometheus_path)
+
+    def serve(self, port: int, host: str = '127.0.0.1') -> ThreadingHTTPServer:
+        """Serves the Prometheus text format on http://host:port/metrics from a daemon thread"""
+        registry = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.rstrip('/') not in ('', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = registry.prometheus_text().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+REGISTRY = Registry()
+
+
+def timed(stage: str):
+    """Records the duration of a scraper method in the stage histogram, labelled with the site"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            with REGISTRY.timer(STAGE_METRIC, stage=stage, site=getattr(self, 'webpage_name', '')):
+                return func(self, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,73 @@
+import argparse
+
+from sqlalchemy import bindparam, select, update
+
+import dedup
+import market_stats
+import project_db
+from project_db import Advertisement, Session
+
+BACKFILL_CHUNK_SIZE = 5000
+
+
+def backfill_typed_columns(chunk_size: int = BACKFILL_CHUNK_SIZE, only_missing: bool = True) -> int:
+    """Fills the normalized numeric and date columns of stored advertisements.
+
+    Rows are processed in id order, one transaction per chunk, so the backfill
+    can be interrupted and re-run safely.
+    """
+    update_stmt = (
+        update(Advertisement.__table__)
+        .where(Advertisement.__table__.c.id == bindparam('row_id'))
+        .values(year_value=bindparam('new_year_value'),
+                mileage_km=bindparam('new_mileage_km'),
+                engine_power_kw=bindparam('new_engine_power_kw'),
+                added_on=bindparam('new_added_on'))
+    )
+    last_id = 0
+    updated = 0
+    while True:
+        with Session() as session:
+            with session.begin():
+                query = (
+                    select(Advertisement.id, Advertisement.year, Advertisement.mileage,
+                           Advertisement.engine_power, Advertisement.date_added)
+                    .where(Advertisement.id > last_id)
+                    .order_by(Advertisement.id)
+                    .limit(chunk_size)
+                )
+                if only_missing:
+                    query = query.where(Advertisement.added_on.is_(None))
+                rows = session.execute(query).all()
+                if not rows:
+                    break
+                params = []
+                for row in rows:
+                    values = project_db.normalized_columns(row.year, row.mileage, row.engine_power, row.date_added)
+                    params.append(dict(row_id=row.id, **{f'new_{key}': value for key, value in values.items()}))
+                session.connection().execute(update_stmt, params)
+        last_id = rows[-1].id
+        updated += len(rows)
+        print(f'backfilled {updated} advertisements')
+    return updated
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Backfill normalized columns and rebuild derived tables')
+    parser.add_argument('--all', action='store_true',
+                        help='recompute the normalized columns of every advertisement, not only missing ones')
+    parser.add_argument('--rebuild-stats', action='store_true',
+                        help='recompute the market price summary tables after the backfill')
+    parser.add_argument('--rebuild-clusters', action='store_true',
+                        help='recompute the cross-site duplicate clusters after the backfill')
+    args = parser.parse_args()
+    backfill_typed_columns(only_missing=not args.all)
+    if args.rebuild_stats:
+        market_stats.rebuild()
+        print('rebuilt market price summary')
+    if args.rebuild_clusters:
+        dedup.rebuild()
+
+
+if __name__ == '__main__':
+    main()
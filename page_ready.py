@@ -0,0 +1,73 @@
+import time
+from collections import defaultdict, deque
+
+from selenium.common import TimeoutException
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.support.wait import WebDriverWait
+
+
+class PageReadiness:
+    """Waits on site specific readiness signals instead of fixed sleeps.
+
+    Timeouts adapt per label to the waits seen so far: a few times the slowest
+    recent wait, kept between ``min_timeout`` and ``max_timeout``. A wait
+    that timed out counts with its full timeout, so the timeout widens again
+    when a site slows down. Every wait is timed so the run can report how much wall-clock time was
+    spent waiting on pages.
+    """
+
+    def __init__(self, min_timeout: float = 3.0, max_timeout: float = 30.0, poll_frequency: float = 0.1,
+                 history: int = 50, factor: float = 4.0):
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.poll_frequency = poll_frequency
+        self.factor = factor
+        self._history = defaultdict(lambda: deque(maxlen=history))
+        self._stats = defaultdict(lambda: {'waits': 0, 'timeouts': 0, 'seconds': 0.0, 'max_seconds': 0.0})
+
+    def timeout_for(self, label: str) -> float:
+        history = self._history[label]
+        if not history:
+            return self.max_timeout
+        return min(self.max_timeout, max(self.min_timeout, self.factor * max(history)))
+
+    def wait(self, driver, condition, label: str, timeout: float = None):
+        """Waits until condition holds, raises TimeoutException when it does not"""
+        timeout = timeout or self.timeout_for(label)
+        stats = self._stats[label]
+        start = time.monotonic()
+        try:
+            result = WebDriverWait(driver, timeout, poll_frequency=self.poll_frequency).until(condition)
+        except TimeoutException:
+            stats['timeouts'] += 1
+            self._history[label].append(timeout)
+            raise
+        finally:
+            elapsed = time.monotonic() - start
+            stats['waits'] += 1
+            stats['seconds'] += elapsed
+            stats['max_seconds'] = max(stats['max_seconds'], elapsed)
+        self._history[label].append(elapsed)
+        return result
+
+    def element(self, driver, locator: tuple, label: str, timeout: float = None):
+        return self.wait(driver, EC.presence_of_element_located(locator), label, timeout)
+
+    def elements(self, driver, locator: tuple, label: str, timeout: float = None):
+        return self.wait(driver, EC.presence_of_all_elements_located(locator), label, timeout)
+
+    def any_clickable(self, driver, locators: list, label: str, timeout: float = None):
+        """Returns the first clickable element among locators"""
+        return self.wait(driver, EC.any_of(*(EC.element_to_be_clickable(loc) for loc in locators)), label, timeout)
+
+    @property
+    def total_seconds(self) -> float:
+        return sum(stats['seconds'] for stats in self._stats.values())
+
+    def report(self) -> dict:
+        return {
+            'total_seconds': round(self.total_seconds, 3),
+            'labels': {label: dict(stats, seconds=round(stats['seconds'], 3),
+                                   max_seconds=round(stats['max_seconds'], 3))
+                       for label, stats in self._stats.items()},
+        }
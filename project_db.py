@@ -1,20 +1,32 @@
-import sqlite3
+import logging
+import os
+import re
+import time
+import threading
 import sqlalchemy
 from datetime import date
 from sqlalchemy import (
-    create_engine, String, Integer, ForeignKey, select, delete
+    create_engine, String, Integer, Date, ForeignKey, Index, select, inspect, text
 )
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm import (
     sessionmaker, DeclarativeBase, relationship, mapped_column, Mapped, MappedAsDataclass, Session
 )
-from typing import List, Optional
+from typing import Callable, List, Optional
 
-SQLALCHEMY_DATABASE_URI = 'sqlite:///project_db.sqlite'
+from metrics import REGISTRY, STAGE_METRIC
+
+logger = logging.getLogger(__name__)
+
+MAX_WRITE_ATTEMPTS = 3
+
+SQLALCHEMY_DATABASE_URI = os.environ.get('CARSCRAPER_DATABASE_URI', 'sqlite:///project_db.sqlite')
 
 class Base(MappedAsDataclass, DeclarativeBase):
     """Base class for declarative models with dataclass support"""
 
-engine = create_engine(SQLALCHEMY_DATABASE_URI, echo=True, echo_pool='debug')
+engine = create_engine(SQLALCHEMY_DATABASE_URI)
 Session = sessionmaker(bind=engine)
 
 class Webpage(Base):
@@ -31,7 +43,14 @@ class Webpage(Base):
 
 class Advertisement(Base):
     __tablename__ = "advertisements"
-    __table_args__ = {'sqlite_autoincrement' : True}
+    __table_args__ = (
+        Index('ix_advertisements_brand_model', 'brand', 'model_version'),
+        Index('ix_advertisements_price', 'price'),
+        Index('ix_advertisements_added_on', 'added_on'),
+        Index('ix_advertisements_mileage_km', 'mileage_km'),
+        Index('ix_advertisements_engine_power_kw', 'engine_power_kw'),
+        {'sqlite_autoincrement' : True},
+    )
 
     id: Mapped[int] = mapped_column(init=False, primary_key=True, autoincrement=True)
     url: Mapped[str] = mapped_column(String(300), nullable=False, unique=True)
@@ -47,9 +66,289 @@ class Advertisement(Base):
     engine_power: Mapped[str] = mapped_column(String(100), nullable=True)
     location: Mapped[str] = mapped_column(String(100), nullable=True)
     date_added: Mapped[str] = mapped_column(String(100), default=None, nullable=False, comment='date added to db')
+    year_value: Mapped[Optional[int]] = mapped_column(Integer, default=None, nullable=True, comment='year parsed from year')
+    mileage_km: Mapped[Optional[int]] = mapped_column(Integer, default=None, nullable=True, comment='mileage parsed to km')
+    engine_power_kw: Mapped[Optional[int]] = mapped_column(Integer, default=None, nullable=True, comment='engine power parsed to kW')
+    added_on: Mapped[Optional[date]] = mapped_column(Date, default=None, nullable=True, comment='date_added as a date')
+
+class CrawlState(Base):
+    __tablename__ = "crawl_state"
+
+    webpage_id: Mapped[int] = mapped_column(ForeignKey('webpages.id'), primary_key=True)
+    newest_url: Mapped[str] = mapped_column(String(300), nullable=True, comment='first listing of the last complete crawl')
+    last_crawl: Mapped[str] = mapped_column(String(100), nullable=True, comment='date of the last complete crawl')
+    new_listings: Mapped[Optional[int]] = mapped_column(Integer, default=None, nullable=True, comment='ads inserted by the last run')
+
+def upgrade_schema() -> None:
+    """Adds columns and indexes introduced after a database was created"""
+    inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        with engine.begin() as connection:
+            for column in table.columns:
+                if column.name not in existing:
+                    column_type = column.type.compile(engine.dialect)
+                    connection.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
 
 # Create tables
 Base.metadata.create_all(bind=engine)
+upgrade_schema()
+
+YEAR_PATTERN = re.compile(r'(?:19|20)\d{2}')
+KW_PATTERN = re.compile(r'(\d[\d\s.,]*)\s*kw', re.IGNORECASE)
+HP_PATTERN = re.compile(r'(\d[\d\s.,]*)\s*(?:hp|ps|k\b|koní)', re.IGNORECASE)
+HP_TO_KW = 0.7355
+
+def _digits(text: str) -> Optional[int]:
+    digits = re.sub(r'\D', '', text)
+    return int(digits) if digits else None
+
+def parse_year(year: Optional[str]) -> Optional[int]:
+    """'06/2019' -> 2019"""
+    match = YEAR_PATTERN.search(year or '')
+    return int(match.group()) if match else None
+
+def parse_mileage_km(mileage: Optional[str]) -> Optional[int]:
+    """'123,000 km' -> 123000"""
+    return _digits(mileage) if mileage else None
+
+def parse_engine_power_kw(engine_power: Optional[str]) -> Optional[int]:
+    """'110 kW (150 hp)' -> 110, horse power only values are converted"""
+    if not engine_power:
+        return None
+    match = KW_PATTERN.search(engine_power)
+    if match:
+        return _digits(match.group(1))
+    match = HP_PATTERN.search(engine_power)
+    if match:
+        hp = _digits(match.group(1))
+        return round(hp * HP_TO_KW) if hp is not None else None
+    return None
+
+def parse_added_on(date_added: Optional[str]) -> Optional[date]:
+    try:
+        return date.fromisoformat(date_added)
+    except (TypeError, ValueError):
+        return None
+
+def normalized_columns(year: Optional[str], mileage: Optional[str], engine_power: Optional[str],
+                       date_added: Optional[str]) -> dict:
+    return dict(
+        year_value=parse_year(year),
+        mileage_km=parse_mileage_km(mileage),
+        engine_power_kw=parse_engine_power_kw(engine_power),
+        added_on=parse_added_on(date_added),
+    )
+
+class AdvertisementWriter:
+    """Buffers scraped advertisements and writes them in bulk.
+
+    Rows are flushed in a single ``INSERT ... ON CONFLICT DO NOTHING``
+    transaction once ``batch_size`` rows are buffered or ``flush_interval``
+    seconds have passed since the last flush. Duplicated urls are counted
+    as skipped instead of failing the whole batch, or overwritten when
+    ``update_existing`` is set. A batch the database can't take right now
+    stays buffered for up to MAX_WRITE_ATTEMPTS flushes, any other failing
+    batch is written row by row so only the bad rows are dropped.
+
+    Functions in ``insert_hooks`` are called with the session and the newly
+    inserted rows inside the insert transaction. Functions in
+    ``update_hooks`` are called with the session, the stored rows and the
+    rows that overwrote them through ``update_existing``. load_hooks registers
+    them when the first writer is created. ``on_write`` is called with the
+    session and the source urls given to ``add`` for the written rows, so
+    the crawl frontier is marked done in the same transaction.
+    """
+
+    insert_hooks = []
+    update_hooks = []
+
+    def __init__(self, batch_size: int = 100, flush_interval: float = 10.0, update_existing: bool = False,
+                 on_write: Optional[Callable] = None):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.update_existing = update_existing
+        self.on_write = on_write
+        self.inserted = 0
+        self.skipped = 0
+        self.failed = 0
+        self._write_attempts = 0
+        self._buffer = []
+        self._sources = []
+        self._webpage_ids = {}
+        self._last_flush = time.monotonic()
+        self._lock = threading.RLock()
+        load_hooks()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def webpage_id(self, webpage_name: str) -> Optional[int]:
+        if webpage_name not in self._webpage_ids:
+            with Session() as session:
+                self._webpage_ids[webpage_name] = session.scalar(
+                    select(Webpage.id).filter_by(page_name=webpage_name)
+                )
+        return self._webpage_ids[webpage_name]
+
+    def add(self,
+            url: str,
+            webpage_name: str,
+            brand: str,
+            model_version: str,
+            year: str,
+            price: int,
+            mileage: str,
+            gearbox: str,
+            fuel_type: str,
+            engine_power: str,
+            location: str,
+            date_added: Optional[str] = None,
+            source_url: Optional[str] = None) -> None:
+        webpage_id = self.webpage_id(webpage_name)
+        if webpage_id is None:
+            print(f'webpage not found: {webpage_name}')
+            return
+        date_added = date_added or date.today().isoformat()
+        row = dict(
+            url=url,
+            webpage_id=webpage_id,
+            brand=brand,
+            model_version=model_version,
+            year=year,
+            price=price,
+            mileage=mileage,
+            gearbox=gearbox,
+            fuel_type=fuel_type,
+            engine_power=engine_power,
+            location=location,
+            date_added=date_added,
+            **normalized_columns(year, mileage, engine_power, date_added)
+        )
+        with self._lock:
+            self._buffer.append(row)
+            self._sources.append(source_url)
+            if (len(self._buffer) >= self.batch_size
+                    or time.monotonic() - self._last_flush >= self.flush_interval):
+                self.flush()
+
+    def add_car_data(self, car_data, webpage_name: str, date_added: Optional[str] = None,
+                     source_url: Optional[str] = None) -> None:
+        self.add(url=car_data.url,
+                 webpage_name=webpage_name,
+                 brand=car_data.brand,
+                 model_version=car_data.model_ver,
+                 year=car_data.year,
+                 price=car_data.price,
+                 mileage=car_data.mileage,
+                 gearbox=car_data.gearbox,
+                 fuel_type=car_data.fuel,
+                 engine_power=car_data.engine_power,
+                 location=car_data.location,
+                 date_added=date_added,
+                 source_url=source_url)
+
+    def flush(self) -> tuple[int, int]:
+        """Writes buffered rows, returns (inserted, skipped) for this flush."""
+        with self._lock:
+            self._last_flush = time.monotonic()
+            if not self._buffer:
+                return 0, 0
+            rows, self._buffer = self._buffer, []
+            sources, self._sources = self._sources, []
+            return self._write(rows, sources)
+
+    def _insert(self, rows: list, sources: list) -> int:
+        """Writes rows and runs the hooks in one transaction, returns the number of rows written"""
+        with REGISTRY.timer(STAGE_METRIC, stage='db_write'), Session() as session:
+            with session.begin():
+                stmt = sqlite_insert(Advertisement)
+                stored = {}
+                if self.update_existing:
+                    stored = {row['url']: dict(row) for row in session.execute(
+                        select(Advertisement.__table__).where(Advertisement.url.in_([row['url'] for row in rows]))
+                    ).mappings()}
+                    stmt = stmt.on_conflict_do_update(
+                        index_elements=['url'],
+                        set_={key: stmt.excluded[key] for key in rows[0] if key not in ('url', 'date_added')}
+                    )
+                else:
+                    stmt = stmt.on_conflict_do_nothing(index_elements=['url'])
+                written_urls = set(session.scalars(stmt.returning(Advertisement.url), rows))
+                inserted = len(written_urls)
+                if self.update_existing:
+                    # Later rows of a url overwrite earlier ones, the last one is what got stored
+                    written_rows = {row['url']: row for row in rows if row['url'] in written_urls}
+                else:
+                    written_rows = {row['url']: row for row in reversed(rows) if row['url'] in written_urls}
+                new_rows = [row for url, row in written_rows.items() if url not in stored]
+                for hook in self.insert_hooks:
+                    hook(session, new_rows)
+                if stored:
+                    old_rows = [stored[url] for url in written_rows if url in stored]
+                    replaced = [written_rows[url] for url in written_rows if url in stored]
+                    for hook in self.update_hooks:
+                        hook(session, old_rows, replaced)
+                sources = [source for source in sources if source]
+                if self.on_write and sources:
+                    self.on_write(session, sources)
+        return inserted
+
+    def _insert_each(self, rows: list, sources: list) -> tuple[int, int]:
+        """Writes rows one transaction each so a bad row only loses itself, returns (inserted, failed)"""
+        inserted = failed = 0
+        for row, source in zip(rows, sources):
+            try:
+                inserted += self._insert([row], [source])
+            except Exception:
+                logger.exception(f"Dropping advertisement {row['url']}")
+                failed += 1
+        return inserted, failed
+
+    def _write(self, rows: list, sources: list = ()) -> tuple[int, int]:
+        failed = 0
+        try:
+            inserted = self._insert(rows, sources)
+            self._write_attempts = 0
+        except OperationalError:
+            # Locked or unreachable database, the whole batch is tried again with the next flush
+            self._write_attempts += 1
+            if self._write_attempts < MAX_WRITE_ATTEMPTS:
+                logger.exception(f"Error adding {len(rows)} advertisements to database, keeping them for the "
+                                 f"next flush (attempt {self._write_attempts} of {MAX_WRITE_ATTEMPTS})")
+                with self._lock:
+                    self._buffer[:0] = rows
+                    self._sources[:0] = sources
+                return 0, 0
+            logger.exception(f"Error adding {len(rows)} advertisements to database, "
+                             f"giving up after {MAX_WRITE_ATTEMPTS} attempts")
+            self._write_attempts = 0
+            inserted, failed = 0, len(rows)
+        except Exception:
+            logger.exception(f"Error adding {len(rows)} advertisements to database, writing them one by one")
+            inserted, failed = self._insert_each(rows, sources)
+        skipped = len(rows) - inserted - failed
+        REGISTRY.inc('carscraper_db_rows_total', inserted, result='inserted')
+        REGISTRY.inc('carscraper_db_rows_total', skipped, result='skipped')
+        REGISTRY.inc('carscraper_db_rows_total', failed, result='failed')
+        self.inserted += inserted
+        self.skipped += skipped
+        self.failed += failed
+        print(f'advertisements added: {inserted}, duplicates skipped: {skipped}, failed: {failed}')
+        return inserted, skipped
+
+    def close(self) -> tuple[int, int]:
+        """Flushes remaining rows, returns (inserted, skipped) totals."""
+        self.flush()
+        # Rows kept after a transient error get their remaining attempts
+        while self._buffer:
+            self.flush()
+        return self.inserted, self.skipped
 
 def add_to_db(url: str,
               webpage_name: str,
@@ -62,36 +361,60 @@ def add_to_db(url: str,
               fuel_type: str,
               engine_power: str,
               location: str) -> None:
+    with AdvertisementWriter(batch_size=1) as writer:
+        writer.add(url=url,
+                   webpage_name=webpage_name,
+                   brand=brand,
+                   model_version=model_version,
+                   year=year,
+                   price=price,
+                   mileage=mileage,
+                   gearbox=gearbox,
+                   fuel_type=fuel_type,
+                   engine_power=engine_power,
+                   location=location)
+
+def iter_advertisement_urls(chunk_size: int = 10_000):
+    with Session() as session:
+        for url in session.scalars(select(Advertisement.url).execution_options(yield_per=chunk_size)):
+            yield url
+
+def count_advertisements() -> int:
+    with Session() as session:
+        return session.scalar(select(sqlalchemy.func.count(Advertisement.id)))
+
+def get_high_water_mark(webpage_name: str) -> Optional[str]:
+    with Session() as session:
+        return session.scalar(
+            select(CrawlState.newest_url).join(Webpage, Webpage.id == CrawlState.webpage_id)
+            .filter(Webpage.page_name == webpage_name)
+        )
+
+def set_high_water_mark(webpage_name: str, newest_url: str) -> None:
+    update_crawl_state(webpage_name, newest_url=newest_url, last_crawl=date.today().isoformat())
+
+def get_new_listings() -> dict:
+    """Ads inserted by the last run of each site, keyed by page_name"""
+    with Session() as session:
+        rows = session.execute(
+            select(Webpage.page_name, CrawlState.new_listings).join(CrawlState, Webpage.id == CrawlState.webpage_id)
+        ).all()
+        return {page_name: new_listings or 0 for page_name, new_listings in rows}
+
+def update_crawl_state(webpage_name: str, **values) -> None:
     try:
         with Session() as session:
             with session.begin():
-                date_added = date.today().isoformat()
-                webpage = session.query(Webpage).filter_by(page_name = webpage_name).first()
-                if not webpage:
+                webpage_id = session.scalar(select(Webpage.id).filter_by(page_name=webpage_name))
+                if webpage_id is None:
                     print(f'webpage not found: {webpage_name}')
                     return
-                advertisement = Advertisement(
-                    url=url,
-                    webpage_id=webpage.id,
-                    webpage=webpage,
-                    brand=brand,
-                    model_version=model_version,
-                    year=year,
-                    price=price,
-                    mileage=mileage,
-                    gearbox=gearbox,
-                    fuel_type=fuel_type,
-                    engine_power=engine_power,
-                    location=location,
-                    date_added=date_added
+                session.execute(
+                    sqlite_insert(CrawlState).values(webpage_id=webpage_id, **values)
+                    .on_conflict_do_update(index_elements=['webpage_id'], set_=values)
                 )
-                session.add(advertisement)
-                print(f'advertisement added: {advertisement}')
-
-    except sqlalchemy.exc.IntegrityError:
-        print("Duplicate entry or constraint violation. Skipping this advertisement.")
     except Exception as e:
-        print(f"Error adding to database: {e}")
+        print(f"Error saving crawl state: {e}")
 
 def if_advertisement_exists(url: str) -> bool:
     try:
@@ -103,6 +426,22 @@ def if_advertisement_exists(url: str) -> bool:
         return False
 
 
+_hooks_lock = threading.Lock()
+_hooks_loaded = False
+
+def load_hooks() -> None:
+    """Registers the hooks keeping the market summary and duplicate clusters in step, once per process"""
+    global _hooks_loaded
+    # Scheduler threads create their first writers at the same time
+    with _hooks_lock:
+        if _hooks_loaded:
+            return
+        import market_stats
+        import dedup
+        AdvertisementWriter.insert_hooks.extend([market_stats.update_stats, dedup.update_clusters])
+        AdvertisementWriter.update_hooks.extend([market_stats.replace_stats, dedup.replace_clusters])
+        _hooks_loaded = True
+
 
 if __name__ == '__main__':
     webpage1 = Webpage(url='https://www.autoscout24.com', page_name='autoscout24')
@@ -0,0 +1,62 @@
+import argparse
+import logging
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import autoscout24_scraper
+import autovia_scraper
+import project_db
+from http_engine import parse_car_data
+from snapshot_store import SNAPSHOT_DIR, SnapshotStore
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+logger.addHandler(logging.StreamHandler(sys.stdout))
+
+SITES = {
+    'autoscout24': autoscout24_scraper,
+    'autovia': autovia_scraper,
+}
+
+
+def _parse_entry(root: str, entry: dict):
+    try:
+        html = SnapshotStore(root).load(entry['sha256'])
+    except Exception as e:
+        return entry, None, str(e)
+    return entry, parse_car_data(SITES[entry['site']], entry['url'], html), None
+
+
+def reparse(root: str = SNAPSHOT_DIR, workers: int = None, site: str = None, update_existing: bool = False,
+            chunksize: int = 16) -> tuple[int, int]:
+    """Runs the extractors over stored snapshots and writes the results, without network access"""
+    store = SnapshotStore(root)
+    entries = [entry for entry in store.entries() if entry['site'] in SITES and (site is None or entry['site'] == site)]
+    logger.info(f"Re-parsing {len(entries)} snapshots")
+
+    failed = 0
+    with project_db.AdvertisementWriter(update_existing=update_existing) as writer, \
+            ProcessPoolExecutor(max_workers=workers) as executor:
+        for entry, car_data, error in executor.map(_parse_entry, [root] * len(entries), entries,
+                                                   chunksize=chunksize):
+            if car_data is None:
+                failed += 1
+                logger.info(f"Could not re-parse {entry['url']}: {error or 'missing fields'}")
+                continue
+            writer.add_car_data(car_data, entry['site'], date_added=entry['date'])
+    logger.info(f"Advertisements written: {writer.inserted}, skipped: {writer.skipped}, failed: {failed}")
+    return writer.inserted, writer.skipped
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Re-parse stored detail page snapshots into the database')
+    parser.add_argument('--snapshots', metavar='DIR', default=SNAPSHOT_DIR)
+    parser.add_argument('--site', choices=sorted(SITES), default=None)
+    parser.add_argument('--workers', type=int, default=None, help='parser processes, defaults to the cpu count')
+    parser.add_argument('--update', action='store_true', help='overwrite advertisements that already exist')
+    args = parser.parse_args()
+    reparse(args.snapshots, workers=args.workers, site=args.site, update_existing=args.update)
+
+
+if __name__ == '__main__':
+    main()
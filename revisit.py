@@ -0,0 +1,255 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import sys
+import time
+from datetime import date, datetime, timedelta
+from typing import Optional
+
+import aiohttp
+from sqlalchemy import ForeignKey, Index, Integer, String, or_, select, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Mapped, mapped_column
+
+import market_stats
+import project_db
+from http_engine import USER_AGENT, load_cookie_jar, parse_fields
+from metrics import REGISTRY, STAGE_METRIC
+from project_db import Advertisement, Base, Session, Webpage
+from rate_limit import limiter_for
+from scheduler import SITES
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+logger.addHandler(logging.StreamHandler(sys.stdout))
+
+REVISIT_INTERVAL = timedelta(days=1)
+BATCH_SIZE = 200
+
+
+class AdRevisit(Base):
+    __tablename__ = "ad_revisits"
+    __table_args__ = (
+        Index('ix_ad_revisits_last_checked', 'last_checked'),
+    )
+
+    advertisement_id: Mapped[int] = mapped_column(ForeignKey('advertisements.id'), primary_key=True)
+    last_checked: Mapped[str] = mapped_column(String(30), nullable=False, comment='iso time of the last revisit')
+    status: Mapped[str] = mapped_column(String(20), nullable=False, comment='unchanged, changed, removed or failed')
+    etag: Mapped[Optional[str]] = mapped_column(String(200), default=None, nullable=True)
+    last_modified: Mapped[Optional[str]] = mapped_column(String(100), default=None, nullable=True)
+    content_hash: Mapped[Optional[str]] = mapped_column(String(64), default=None, nullable=True,
+                                                        comment='sha256 of the extracted field values')
+
+
+class PriceHistory(Base):
+    __tablename__ = "price_history"
+    __table_args__ = (
+        Index('ix_price_history_advertisement_id', 'advertisement_id'),
+        {'sqlite_autoincrement': True},
+    )
+
+    id: Mapped[int] = mapped_column(init=False, primary_key=True, autoincrement=True)
+    advertisement_id: Mapped[int] = mapped_column(ForeignKey('advertisements.id'), nullable=False)
+    old_price: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+    new_price: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+    observed_on: Mapped[str] = mapped_column(String(100), nullable=False)
+
+
+Base.metadata.create_all(bind=project_db.engine, tables=[AdRevisit.__table__, PriceHistory.__table__])
+
+
+def content_hash(values: dict) -> str:
+    """Hash of the extracted fields, stable across changes to the rest of the page markup"""
+    return hashlib.sha256(json.dumps(values, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def due_advertisements(sites, interval: timedelta = REVISIT_INTERVAL, limit: int = BATCH_SIZE) -> list:
+    """Ads of the given sites not revisited within interval, never visited and longest unvisited first"""
+    cutoff = (datetime.now() - interval).isoformat(timespec='seconds')
+    with Session() as session:
+        return session.execute(
+            select(Advertisement.id, Advertisement.url, Advertisement.price, Advertisement.webpage_id,
+                   Advertisement.brand, Advertisement.model_version, Advertisement.year_value, Webpage.page_name,
+                   AdRevisit.etag, AdRevisit.last_modified, AdRevisit.content_hash)
+            .join(Webpage, Advertisement.webpage_id == Webpage.id)
+            .outerjoin(AdRevisit, AdRevisit.advertisement_id == Advertisement.id)
+            .where(Webpage.page_name.in_(list(sites)),
+                   or_(AdRevisit.last_checked.is_(None), AdRevisit.last_checked < cutoff),
+                   or_(AdRevisit.status.is_(None), AdRevisit.status != 'removed'))
+            .order_by(AdRevisit.last_checked.nulls_first(), Advertisement.id)
+            .limit(limit)
+        ).mappings().all()
+
+
+class Revisitor:
+    """Re-checks stored ads over http and records their price changes.
+
+    Requests carry the validators of the previous visit, so servers that
+    support them answer unchanged pages with a bodyless 304. Other pages are
+    compared by a hash of their extracted fields and only parsed further when
+    it changed. Each site keeps to its scheduler rate limit. Ads are taken
+    longest unvisited first until ``budget`` seconds are used up, so repeated
+    runs rotate through the whole table.
+    """
+
+    def __init__(self, sites: dict = None, budget: float = 600, interval: timedelta = REVISIT_INTERVAL,
+                 concurrency: int = 8, batch_size: int = BATCH_SIZE, timeout: float = 30):
+        self.sites = sites if sites is not None else SITES
+        self.budget = budget
+        self.interval = interval
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.counts = dict(unchanged=0, changed=0, removed=0, failed=0)
+
+    def run(self) -> dict:
+        deadline = time.monotonic() + self.budget
+        while time.monotonic() < deadline:
+            ads = due_advertisements(self.sites, self.interval, self.batch_size)
+            if not ads:
+                logger.info("No advertisements due for a revisit")
+                break
+            results = asyncio.run(self.check_batch(ads, deadline))
+            self.save(results)
+        logger.info(f"Revisit finished: {self.counts}")
+        return self.counts
+
+    async def check_batch(self, ads: list, deadline: float) -> list:
+        semaphore = asyncio.Semaphore(self.concurrency)
+        sessions = {}
+        try:
+            for name in {ad['page_name'] for ad in ads}:
+                config = self.sites[name]
+                sessions[name] = aiohttp.ClientSession(
+                    cookies=load_cookie_jar(config.cookies_file) if config.cookies_file else None,
+                    headers={'User-Agent': USER_AGENT},
+                    timeout=aiohttp.ClientTimeout(total=self.timeout))
+            results = await asyncio.gather(*(
+                self.check(sessions[ad['page_name']], semaphore, ad, deadline) for ad in ads
+            ))
+        finally:
+            for session in sessions.values():
+                await session.close()
+        return [result for result in results if result is not None]
+
+    async def check(self, session: aiohttp.ClientSession, semaphore: asyncio.Semaphore, ad, deadline: float):
+        """Returns (ad, status, revisit values, new price), None once the budget is used up"""
+        async with semaphore:
+            if time.monotonic() >= deadline:
+                return None
+            config = self.sites[ad['page_name']]
+            await asyncio.to_thread(limiter_for(config.scraper_cls.domain, config.rate, config.burst).acquire)
+            headers = {}
+            if ad['etag']:
+                headers['If-None-Match'] = ad['etag']
+            if ad['last_modified']:
+                headers['If-Modified-Since'] = ad['last_modified']
+            try:
+                with REGISTRY.timer(STAGE_METRIC, stage='revisit_fetch', site=ad['page_name']):
+                    async with session.get(ad['url'], headers=headers) as response:
+                        if response.status == 304:
+                            return ad, 'unchanged', {}, None
+                        if response.status in (404, 410):
+                            return ad, 'removed', {}, None
+                        response.raise_for_status()
+                        html = await response.text()
+                        validators = dict(etag=response.headers.get('ETag'),
+                                          last_modified=response.headers.get('Last-Modified'))
+            except Exception as e:
+                logger.info(f"Revisit failed for {ad['url']}: {e}")
+                return ad, 'failed', {}, None
+        return self.compare(ad, html, validators)
+
+    def compare(self, ad, html: str, validators: dict):
+        site = sys.modules[self.sites[ad['page_name']].scraper_cls.__module__]
+        values = parse_fields(html, site.FIELDS)
+        if values.get('price') is None:
+            logger.info(f"No price on {ad['url']}")
+            return ad, 'failed', {}, None
+        digest = content_hash(values)
+        revisit = dict(validators, content_hash=digest)
+        if digest == ad['content_hash']:
+            return ad, 'unchanged', revisit, None
+        try:
+            price = site.parse_price(values['price'])
+        except ValueError as e:
+            logger.info(f"Could not parse price of {ad['url']}: {e}")
+            return ad, 'failed', {}, None
+        if ad['content_hash'] is None and price == ad['price']:
+            # First revisit, there is no earlier hash to compare with, only the stored price
+            return ad, 'unchanged', revisit, None
+        return ad, 'changed', revisit, price
+
+    def save(self, results: list) -> None:
+        now = datetime.now().isoformat(timespec='seconds')
+        today = date.today().isoformat()
+        revisits, history, changed = [], [], []
+        for ad, status, revisit, price in results:
+            self.counts[status] += 1
+            REGISTRY.inc('carscraper_revisits_total', site=ad['page_name'], result=status)
+            revisits.append(dict(advertisement_id=ad['id'], last_checked=now, status=status,
+                                 etag=revisit.get('etag', ad['etag']),
+                                 last_modified=revisit.get('last_modified', ad['last_modified']),
+                                 content_hash=revisit.get('content_hash', ad['content_hash'])))
+            if price is not None and price != ad['price']:
+                history.append(dict(advertisement_id=ad['id'], old_price=ad['price'], new_price=price,
+                                    observed_on=today))
+                changed.append(ad)
+        if not revisits:
+            return
+        try:
+            with Session() as session:
+                with session.begin():
+                    stmt = sqlite_insert(AdRevisit)
+                    stmt = stmt.on_conflict_do_update(
+                        index_elements=['advertisement_id'],
+                        set_={key: stmt.excluded[key] for key in revisits[0] if key != 'advertisement_id'}
+                    )
+                    session.execute(stmt, revisits)
+                    if history:
+                        session.execute(sqlite_insert(PriceHistory), history)
+                        for row in history:
+                            session.execute(update(Advertisement).where(Advertisement.id == row['advertisement_id'])
+                                            .values(price=row['new_price']))
+                        repriced = [dict(ad, price=row['new_price']) for ad, row in zip(changed, history)]
+                        market_stats.replace_stats(session, changed, repriced)
+        except Exception:
+            logger.exception("Error saving revisits")
+            return
+        logger.info(f'advertisements revisited: {len(revisits)}, price changes: {len(history)}')
+
+
+def price_history(url: str) -> list:
+    """Recorded price changes of an ad, oldest first"""
+    with Session() as session:
+        return session.execute(
+            select(PriceHistory.observed_on, PriceHistory.old_price, PriceHistory.new_price)
+            .join(Advertisement, PriceHistory.advertisement_id == Advertisement.id)
+            .where(Advertisement.url == url)
+            .order_by(PriceHistory.id)
+        ).mappings().all()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Re-check stored ads for price changes')
+    parser.add_argument('--site', choices=sorted(SITES), default=None)
+    parser.add_argument('--budget', type=float, default=10, help='minutes to spend before stopping')
+    parser.add_argument('--interval', type=float, default=24, help='hours before an ad is due again')
+    parser.add_argument('--concurrency', type=int, default=8, help='parallel requests across all sites')
+    parser.add_argument('--metrics-json', metavar='FILE', default=None, help='write a per-run metrics summary')
+    parser.add_argument('--metrics-prom', metavar='FILE', default=None, help='write metrics in Prometheus text format')
+    args = parser.parse_args()
+
+    sites = {args.site: SITES[args.site]} if args.site else SITES
+    revisitor = Revisitor(sites, budget=args.budget * 60, interval=timedelta(hours=args.interval),
+                          concurrency=args.concurrency)
+    try:
+        revisitor.run()
+    finally:
+        REGISTRY.export(args.metrics_json, args.metrics_prom)
+
+if __name__ == '__main__':
+    main()
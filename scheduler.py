@@ -0,0 +1,148 @@
+import argparse
+import logging
+import os
+import sys
+import threading
+from dataclasses import dataclass
+
+import project_db
+from autoscout24_scraper import AUTOSCOUT24_URL, Autoscout24Scraper
+from autovia_scraper import AUTOVIA_URL, AutoviaScraper
+from base_scraper import add_run_arguments, run_scrape_kwargs
+from metrics import REGISTRY
+from rate_limit import limiter_for
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+logger.addHandler(logging.StreamHandler(sys.stdout))
+
+
+@dataclass
+class SiteConfig:
+    """Politeness budget of one site.
+
+    At most ``max_workers`` browsers with up to ``max_tabs`` tabs each, and
+    ``rate`` page requests per second in bursts of ``burst``.
+    """
+    scraper_cls: type
+    url: str
+    max_workers: int = 4
+    max_tabs: int = 5
+    rate: float = 2.0
+    burst: int = 5
+    cookies_file: str = None
+
+
+SITES = {
+    'autoscout24': SiteConfig(Autoscout24Scraper, AUTOSCOUT24_URL, max_workers=4, rate=2.0,
+                              cookies_file='autoscout24_cookies.pkl'),
+    'autovia': SiteConfig(AutoviaScraper, AUTOVIA_URL, max_workers=2, rate=1.0),
+}
+
+
+def allocate_workers(budget: int, sites: dict, new_listings: dict) -> dict:
+    """Splits a browser budget between sites by their new listings in the last run.
+
+    Every site gets one worker, the rest goes one at a time to the site with
+    the most new listings per allocated worker until the budget or all site
+    caps are used up. Sites without history count as one new listing. When
+    the budget is smaller than the number of sites, only the sites with the
+    most new listings get their worker and the others are left out.
+    """
+    order = sorted(sites, key=lambda n: new_listings.get(n, 0), reverse=True)
+    allocation = {name: 1 for name in order[:max(budget, 0)]}
+    budget -= len(allocation)
+    while budget > 0:
+        open_sites = [name for name in allocation if allocation[name] < sites[name].max_workers]
+        if not open_sites:
+            break
+        name = max(open_sites, key=lambda n: (new_listings.get(n, 0) + 1) / allocation[n])
+        allocation[name] += 1
+        budget -= 1
+    return allocation
+
+
+class Scheduler:
+    """Runs the scrapers of several sites concurrently, one thread per site.
+
+    Each site scrapes with its own worker count from allocate_workers and a
+    rate limiter shared by all of its browsers, so adding sites adds
+    throughput without raising the load on any single domain. Sites are
+    started in order of their new listings. Sites that don't fit into the
+    budget wait for the running ones to finish and are scraped in a next
+    round with the whole budget.
+    """
+
+    def __init__(self, sites: dict = None, budget: int = 4, scraper_kwargs: dict = None, scrape_kwargs: dict = None,
+                 session_dir: str = None):
+        self.sites = sites if sites is not None else SITES
+        self.budget = budget
+        self.scraper_kwargs = scraper_kwargs or {}
+        self.scrape_kwargs = scrape_kwargs or {}
+        self.session_dir = session_dir
+        self.results = {}
+
+    def build_scraper(self, name: str, config: SiteConfig):
+        kwargs = dict(self.scraper_kwargs)
+        kwargs['rate_limiter'] = limiter_for(config.scraper_cls.domain, config.rate, config.burst)
+        if config.cookies_file:
+            kwargs['cookies_file'] = config.cookies_file
+        if self.session_dir:
+            kwargs['session_dir'] = os.path.join(self.session_dir, name)
+        return config.scraper_cls(config.url, **kwargs)
+
+    def _run_site(self, name: str, config: SiteConfig, workers: int) -> None:
+        try:
+            scraper = self.build_scraper(name, config)
+            scraper.scrape(workers=workers, mode='thread', max_tabs=config.max_tabs, **self.scrape_kwargs)
+            self.results[name] = 'done'
+        except Exception as e:
+            logger.error(f"Scraping {name} failed: {e}")
+            self.results[name] = f'failed: {e}'
+
+    def run(self) -> dict:
+        if self.budget < 1:
+            raise ValueError(f"Scheduler budget must be at least one browser, got {self.budget}")
+        new_listings = project_db.get_new_listings()
+        waiting = dict(self.sites)
+        while waiting:
+            allocation = allocate_workers(self.budget, waiting, new_listings)
+            threads = []
+            for name, workers in allocation.items():
+                logger.info(f"Starting {name} with {workers} workers, "
+                            f"{new_listings.get(name, 0)} new listings last run")
+                thread = threading.Thread(target=self._run_site, args=(name, waiting.pop(name), workers),
+                                          name=f'site-{name}', daemon=True)
+                thread.start()
+                threads.append(thread)
+            if waiting:
+                logger.info(f"Sites waiting for a free browser: {', '.join(waiting)}")
+            for thread in threads:
+                thread.join()
+        logger.info(f"Scheduler finished: {self.results}")
+        return self.results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Scrape all registered sites concurrently')
+    parser.add_argument('--sites', nargs='+', choices=sorted(SITES), default=sorted(SITES))
+    parser.add_argument('--budget', type=int, default=4, help='total number of browsers across all sites')
+    add_run_arguments(parser)
+    args = parser.parse_args()
+    if args.metrics_port:
+        REGISTRY.serve(args.metrics_port)
+
+    scheduler = Scheduler(
+        {name: SITES[name] for name in args.sites},
+        budget=args.budget,
+        scraper_kwargs=dict(snapshot_dir=args.snapshots, profile=args.profile),
+        scrape_kwargs=run_scrape_kwargs(args),
+        session_dir=args.sessions,
+    )
+    try:
+        scheduler.run()
+    finally:
+        REGISTRY.export(args.metrics_json, args.metrics_prom)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+import json
+import logging
+import os
+import socket
+import tempfile
+import time
+from typing import Iterable
+
+logger = logging.getLogger(__name__)
+
+SESSION_DIR = 'browser_sessions'
+
+# Redo the consent flow at least this often even if the cookies look valid
+DEFAULT_CONSENT_MAX_AGE = 7 * 24 * 3600
+
+# Files Chrome leaves behind in a profile after a crash, which block reuse
+_STALE_LOCK_FILES = ('SingletonLock', 'SingletonSocket', 'SingletonCookie')
+
+
+class BrowserSession:
+    """Persistent Chrome user-data-dir for one site, kept across runs.
+
+    Cookies, consent state and the HTTP cache live in the profile, so a warm
+    run skips the consent flow. Consent is considered stale when one of the
+    site's consent cookies is missing or expired, when the site redirected to
+    a consent page, or when it was given longer than ``max_age`` seconds ago.
+    """
+
+    def __init__(self, path: str, consent_cookies: Iterable[str] = (), max_age: float = DEFAULT_CONSENT_MAX_AGE):
+        self.path = os.path.abspath(path)
+        self.profile_dir = os.path.join(self.path, 'chrome-profile')
+        self.consent_cookies = tuple(consent_cookies)
+        self.max_age = max_age
+        self._state_path = os.path.join(self.path, 'consent.json')
+        os.makedirs(self.profile_dir, exist_ok=True)
+
+    def _lock_owner_alive(self) -> bool:
+        """Whether the profile's SingletonLock, a ``host-pid`` symlink, belongs to a running Chrome"""
+        try:
+            owner = os.readlink(os.path.join(self.profile_dir, 'SingletonLock'))
+        except OSError:
+            return False
+        host, _, pid = owner.rpartition('-')
+        if not pid.isdigit():
+            return False
+        if host != socket.gethostname():
+            # A profile on a shared disk, its owner can't be checked from here
+            return True
+        try:
+            os.kill(int(pid), 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            return True
+        return True
+
+    def chrome_arguments(self) -> list:
+        if self._lock_owner_alive():
+            profile_dir = tempfile.mkdtemp(prefix='chrome-profile-')
+            logger.warning(f"Profile {self.profile_dir} is in use by another browser, using a temporary profile")
+            return [f'--user-data-dir={profile_dir}']
+        for name in _STALE_LOCK_FILES:
+            lock = os.path.join(self.profile_dir, name)
+            if os.path.lexists(lock):
+                os.remove(lock)
+        return [f'--user-data-dir={self.profile_dir}']
+
+    def _state(self) -> dict:
+        try:
+            with open(self._state_path, encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def consent_valid(self, driver) -> bool:
+        consented_at = self._state().get('consented_at')
+        if consented_at is None or time.time() - consented_at > self.max_age:
+            return False
+        if 'consent' in driver.current_url.lower():
+            logger.info("Consent page shown, consent state is stale")
+            return False
+        now = time.time()
+        cookies = {cookie['name']: cookie for cookie in driver.get_cookies()}
+        for name in self.consent_cookies:
+            cookie = cookies.get(name)
+            if cookie is None or cookie.get('expiry', now + 1) <= now:
+                logger.info(f"Consent cookie {name} missing or expired")
+                return False
+        return True
+
+    def mark_consented(self) -> None:
+        with open(self._state_path, 'w', encoding='utf-8') as f:
+            json.dump({'consented_at': time.time()}, f)
+
+    def invalidate(self) -> None:
+        if os.path.exists(self._state_path):
+            os.remove(self._state_path)
@@ -0,0 +1,79 @@
+import gzip
+import hashlib
+import json
+import os
+import threading
+from datetime import date
+from typing import Iterator, Optional
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+SNAPSHOT_DIR = 'snapshots'
+
+
+class SnapshotStore:
+    """Content-addressed store of compressed detail page html.
+
+    Page bodies are written once per content hash under ``objects/`` and
+    compressed with zstd when available, gzip otherwise. ``index.jsonl`` maps
+    (ad url, date, site) to the hash so pages can be re-parsed offline.
+    """
+
+    def __init__(self, root: str = SNAPSHOT_DIR):
+        self.root = root
+        self.suffix = '.zst' if zstandard else '.gz'
+        self._index_path = os.path.join(root, 'index.jsonl')
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(root, 'objects'), exist_ok=True)
+
+    def _object_path(self, digest: str, suffix: str) -> str:
+        return os.path.join(self.root, 'objects', digest[:2], digest[2:] + suffix)
+
+    def save(self, url: str, webpage_name: str, html: str, day: Optional[str] = None) -> str:
+        """Stores html for url, returns its content hash"""
+        data = html.encode('utf-8')
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._object_path(digest, self.suffix)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            compressed = zstandard.ZstdCompressor(level=10).compress(data) if zstandard else gzip.compress(data)
+            tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(compressed)
+            os.replace(tmp_path, path)
+
+        entry = {'url': url, 'date': day or date.today().isoformat(), 'site': webpage_name, 'sha256': digest}
+        with self._lock, open(self._index_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry) + '\n')
+        return digest
+
+    def load(self, digest: str) -> str:
+        for suffix in ('.zst', '.gz'):
+            path = self._object_path(digest, suffix)
+            if os.path.exists(path):
+                with open(path, 'rb') as f:
+                    data = f.read()
+                if suffix == '.zst':
+                    if zstandard is None:
+                        raise RuntimeError('zstandard is required to read .zst snapshots')
+                    return zstandard.ZstdDecompressor().decompress(data).decode('utf-8')
+                return gzip.decompress(data).decode('utf-8')
+        raise FileNotFoundError(f'No snapshot object {digest}')
+
+    def entries(self, latest_only: bool = True) -> Iterator[dict]:
+        """Yields index entries, by default only the latest snapshot of each url"""
+        if not os.path.exists(self._index_path):
+            return
+        with open(self._index_path, encoding='utf-8') as f:
+            entries = (json.loads(line) for line in f if line.strip())
+            if not latest_only:
+                yield from entries
+                return
+            latest = {}
+            for entry in entries:
+                if entry['url'] not in latest or entry['date'] >= latest[entry['url']]['date']:
+                    latest[entry['url']] = entry
+        yield from latest.values()
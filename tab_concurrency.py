@@ -0,0 +1,91 @@
+import logging
+from itertools import islice
+from typing import Iterable, Iterator, Optional
+
+from metrics import REGISTRY
+from rate_limit import RateLimiter
+
+logger = logging.getLogger(__name__)
+
+TABS_METRIC = 'carscraper_open_tabs'
+
+REGISTRY.set_buckets(TABS_METRIC, (1, 2, 3, 4, 5, 6, 8, 10, 12, 16, 20, 24, 32))
+
+
+class TabController:
+    """Chooses how many tabs a driver opens at once with an AIMD loop.
+
+    After every batch ``update`` receives the batch's pages, failures and
+    wall time. The tab count grows by ``increase`` while pages keep loading
+    fast and is multiplied by ``decrease`` when the failure rate passes
+    ``max_failure_rate``, the time per page exceeds ``slowdown`` times its
+    best recent value, or the browser is short of memory. The best time per
+    page decays towards current values so a slower site later in the day
+    becomes the new baseline instead of pinning the count at ``minimum``.
+    With a ``rate_limiter`` the count stays within its burst, further tabs
+    would only wait for the limiter before loading.
+    """
+
+    def __init__(self, site: str = '', initial: int = 5, minimum: int = 1, maximum: int = 20, increase: int = 1,
+                 decrease: float = 0.5, max_failure_rate: float = 0.2, slowdown: float = 1.5,
+                 baseline_decay: float = 0.05, rate_limiter: Optional[RateLimiter] = None):
+        if rate_limiter:
+            maximum = max(minimum, min(maximum, rate_limiter.burst))
+        self.site = site
+        self.size = max(minimum, min(initial, maximum))
+        self.minimum = minimum
+        self.maximum = maximum
+        self.increase = increase
+        self.decrease = decrease
+        self.max_failure_rate = max_failure_rate
+        self.slowdown = slowdown
+        self.baseline_decay = baseline_decay
+        self.baseline = None
+        self.decreases = 0
+
+    @classmethod
+    def fixed(cls, size: int, site: str = '') -> 'TabController':
+        return cls(site, initial=size, minimum=size, maximum=size)
+
+    def batches(self, links: Iterable[str]) -> Iterator[list]:
+        """Splits links into batches of the tab count current when each batch is taken"""
+        iterator = iter(links)
+        while batch := list(islice(iterator, self.size)):
+            yield batch
+
+    def congestion(self, pages: int, failures: int, seconds: float, memory_pressure: bool = False) -> Optional[str]:
+        if memory_pressure:
+            return 'memory'
+        if failures / pages > self.max_failure_rate:
+            return 'failures'
+        per_page = seconds / pages
+        if self.baseline is None:
+            self.baseline = per_page
+        elif per_page > self.baseline * self.slowdown:
+            # Slow batches pull the baseline up only slowly, so lasting slowness still counts as congestion
+            self.baseline += (per_page - self.baseline) * self.baseline_decay
+            return 'latency'
+        else:
+            self.baseline = min(per_page, self.baseline + (per_page - self.baseline) * self.baseline_decay)
+        return None
+
+    def update(self, pages: int, failures: int, seconds: float, memory_pressure: bool = False) -> int:
+        """Adjusts the tab count to the last batch's outcome and returns it"""
+        if not pages:
+            return self.size
+        reason = self.congestion(pages, failures, seconds, memory_pressure)
+        if reason:
+            size = max(self.minimum, int(self.size * self.decrease))
+            if size != self.size:
+                self.decreases += 1
+                REGISTRY.inc('carscraper_tab_decreases_total', site=self.site, reason=reason)
+                logger.info(f"Lowering {self.site} tabs from {self.size} to {size} ({reason})")
+            self.size = size
+        else:
+            self.size = min(self.maximum, self.size + self.increase)
+        REGISTRY.observe(TABS_METRIC, self.size, site=self.site)
+        return self.size
+
+    def report(self) -> dict:
+        return dict(tabs=self.size, decreases=self.decreases,
+                    baseline_page_seconds=round(self.baseline, 3) if self.baseline is not None else None)
@@ -0,0 +1,38 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# project_db binds its engine on import, point it at a scratch database first
+_db_dir = tempfile.mkdtemp(prefix='carscraper-tests-')
+os.environ['CARSCRAPER_DATABASE_URI'] = f"sqlite:///{os.path.join(_db_dir, 'test.sqlite')}"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import project_db  # noqa: E402
+from project_db import Base, Session, Webpage  # noqa: E402
+
+project_db.load_hooks()
+import frontier  # noqa: E402,F401  registers the frontier table
+
+
+@pytest.fixture
+def db():
+    """Empty tables with the two sites registered"""
+    with Session() as session:
+        with session.begin():
+            for table in reversed(Base.metadata.sorted_tables):
+                session.execute(table.delete())
+            session.add_all([Webpage(url='https://www.autoscout24.com', page_name='autoscout24'),
+                             Webpage(url='https://www.autovia.sk', page_name='autovia')])
+    yield
+
+
+@pytest.fixture
+def add_ad():
+    """Writes one advertisement through the buffered writer, typed columns included"""
+    def add(writer, url, site='autoscout24', brand='Skoda', model_version='Octavia', year='2015', price=10000,
+            mileage='100 000 km', engine_power='110 kW', fuel_type='Diesel', source_url=None):
+        writer.add(url, site, brand, model_version, year, price, mileage, 'Manual', fuel_type, engine_power,
+                   'Bratislava', source_url=source_url)
+    return add
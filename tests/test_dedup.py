@@ -0,0 +1,41 @@
+import dedup
+from project_db import AdvertisementWriter
+
+
+def test_same_car_on_two_sites_is_clustered(db, add_ad):
+    with AdvertisementWriter() as writer:
+        add_ad(writer, 'https://www.autoscout24.com/offers/1', mileage='100 000 km', price=10000)
+        add_ad(writer, 'https://www.autovia.sk/1', site='autovia', brand='Škoda', mileage='101 000 km',
+               price=10200)
+    assert dedup.duplicates_of('https://www.autoscout24.com/offers/1') == ['https://www.autovia.sk/1']
+    assert dedup.duplicates_of('https://www.autovia.sk/1') == ['https://www.autoscout24.com/offers/1']
+
+
+def test_same_site_and_different_cars_are_not_clustered(db, add_ad):
+    with AdvertisementWriter() as writer:
+        add_ad(writer, 'https://www.autoscout24.com/offers/1')
+        add_ad(writer, 'https://www.autoscout24.com/offers/2')
+        add_ad(writer, 'https://www.autovia.sk/1', site='autovia', mileage='180 000 km', price=6000)
+    assert dedup.duplicates_of('https://www.autoscout24.com/offers/1') == []
+    assert dedup.duplicates_of('https://www.autovia.sk/1') == []
+
+
+def test_updated_ad_is_reindexed(db, add_ad):
+    with AdvertisementWriter() as writer:
+        add_ad(writer, 'https://www.autoscout24.com/offers/1')
+        add_ad(writer, 'https://www.autovia.sk/1', site='autovia', mileage='180 000 km')
+    with AdvertisementWriter(update_existing=True) as writer:
+        add_ad(writer, 'https://www.autovia.sk/1', site='autovia', mileage='100 500 km')
+    assert dedup.duplicates_of('https://www.autoscout24.com/offers/1') == ['https://www.autovia.sk/1']
+
+
+def test_rebuild_matches_incremental_clusters(db, add_ad):
+    with AdvertisementWriter() as writer:
+        add_ad(writer, 'https://www.autoscout24.com/offers/1')
+        add_ad(writer, 'https://www.autovia.sk/1', site='autovia', mileage='100 800 km')
+        add_ad(writer, 'https://www.autovia.sk/2', site='autovia', brand='Audi', model_version='A4')
+    urls = ['https://www.autoscout24.com/offers/1', 'https://www.autovia.sk/1', 'https://www.autovia.sk/2']
+    incremental = {url: sorted(dedup.duplicates_of(url)) for url in urls}
+    assert incremental[urls[0]] == [urls[1]]
+    dedup.rebuild()
+    assert {url: sorted(dedup.duplicates_of(url)) for url in urls} == incremental
@@ -0,0 +1,68 @@
+from frontier import DONE, FAILED, IN_FLIGHT, PENDING, Frontier
+from project_db import AdvertisementWriter
+
+
+def test_claimed_hands_out_leftovers_first(db):
+    frontier = Frontier('autoscout24')
+    frontier.add(['old-1', 'old-2'])
+    claimed = list(frontier.claimed(['new-1', 'new-2', 'new-3'], chunk_size=2))
+    assert claimed == ['old-1', 'old-2', 'new-1', 'new-2', 'new-3']
+    assert frontier.counts() == {IN_FLIGHT: 5}
+
+
+def test_sites_are_kept_apart(db):
+    Frontier('autovia').add(['autovia-1'])
+    frontier = Frontier('autoscout24')
+    frontier.add(['autoscout24-1'])
+    assert frontier.claim(10) == ['autoscout24-1']
+    assert Frontier('autovia').counts() == {PENDING: 1}
+
+
+def test_known_urls_keep_their_state(db):
+    frontier = Frontier('autoscout24')
+    frontier.add(['a'])
+    frontier.done(frontier.claim())
+    frontier.add(['a'])
+    assert frontier.counts() == {DONE: 1}
+    assert frontier.claim() == []
+
+
+def test_writer_marks_stored_urls_done(db, add_ad):
+    frontier = Frontier('autoscout24')
+    frontier.add(['https://www.autoscout24.com/offers/1', 'https://www.autoscout24.com/offers/2'])
+    frontier.claim(2)
+    with AdvertisementWriter(on_write=frontier.mark_done) as writer:
+        add_ad(writer, 'https://www.autoscout24.com/offers/1', source_url='https://www.autoscout24.com/offers/1')
+    assert frontier.counts() == {DONE: 1, IN_FLIGHT: 1}
+
+
+def test_failed_urls_are_retried_until_max_attempts(db):
+    frontier = Frontier('autoscout24', max_attempts=2)
+    frontier.add(['a', 'b'])
+    frontier.claim(2)
+    frontier.failed('a', 'timeout')
+    frontier.failed('b', 'not a car', retry=False)
+    assert frontier.counts() == {PENDING: 1, FAILED: 1}
+    assert frontier.claim() == ['a']
+    frontier.failed('a', 'timeout')
+    assert frontier.counts() == {FAILED: 2}
+
+
+def test_recover_returns_only_in_flight_urls(db):
+    frontier = Frontier('autoscout24')
+    frontier.add(['a', 'b', 'c'])
+    frontier.claim(3)
+    frontier.done(['a'])
+    frontier.failed('b', retry=False)
+    assert frontier.recover() == 1
+    assert frontier.counts() == {DONE: 1, FAILED: 1, PENDING: 1}
+    assert frontier.claim() == ['c']
+
+
+def test_reset_forgets_the_site(db):
+    frontier = Frontier('autoscout24')
+    Frontier('autovia').add(['autovia-1'])
+    frontier.add(['a'])
+    frontier.reset()
+    assert frontier.counts() == {}
+    assert Frontier('autovia').counts() == {PENDING: 1}
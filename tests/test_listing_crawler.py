@@ -0,0 +1,32 @@
+import pytest
+
+pytest.importorskip('selenium')
+
+from listing_crawler import IncrementalFilter  # noqa: E402
+from url_index import SeenUrlIndex  # noqa: E402
+
+
+def test_known_links_are_dropped():
+    index = SeenUrlIndex(['b'])
+    links = IncrementalFilter(index)(['a', 'b', 'c'])
+    assert list(links) == ['a', 'c']
+    assert 'c' in index
+
+
+def test_stops_at_high_water_mark_after_first_position():
+    incremental = IncrementalFilter(SeenUrlIndex(), high_water_mark='c')
+    assert list(incremental(['pinned', 'a', 'b', 'c', 'd'])) == ['pinned', 'a', 'b']
+    assert incremental.stopped_early
+    assert incremental.newest == 'a'
+
+
+def test_pinned_high_water_mark_is_ignored():
+    incremental = IncrementalFilter(SeenUrlIndex(), high_water_mark='pinned')
+    assert list(incremental(['pinned', 'a', 'b'])) == ['pinned', 'a', 'b']
+    assert not incremental.stopped_early
+
+
+def test_stops_after_a_run_of_known_links():
+    incremental = IncrementalFilter(SeenUrlIndex(['k1', 'k2', 'k3']), known_run=2)
+    assert list(incremental(['a', 'k1', 'b', 'k2', 'k3', 'c'])) == ['a', 'b']
+    assert incremental.stopped_early
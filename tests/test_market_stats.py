@@ -0,0 +1,57 @@
+import market_stats
+from project_db import AdvertisementWriter, Session
+from sqlalchemy import select
+
+
+def _summary_tables():
+    with Session() as session:
+        stats = session.execute(select(market_stats.PriceStats)).scalars().all()
+        buckets = session.execute(select(market_stats.PriceBucket)).scalars().all()
+        return (sorted((s.webpage_id, s.brand, s.model_version, s.year_value, s.count, s.price_sum, s.price_min,
+                        s.price_max) for s in stats),
+                sorted((b.webpage_id, b.brand, b.model_version, b.year_value, b.bucket, b.count) for b in buckets))
+
+
+def test_inserts_are_summarised_per_group(db, add_ad):
+    with AdvertisementWriter() as writer:
+        add_ad(writer, 'https://www.autoscout24.com/offers/1', price=10000)
+        add_ad(writer, 'https://www.autoscout24.com/offers/2', price=14000)
+        add_ad(writer, 'https://www.autovia.sk/1', site='autovia', price=9000)
+        add_ad(writer, 'https://www.autoscout24.com/offers/3', model_version='Fabia', price=5000)
+    summary = market_stats.price_summary('Skoda', 'Octavia')
+    assert (summary['count'], summary['mean'], summary['min'], summary['max']) == (3, 11000, 9000, 14000)
+    assert market_stats.price_summary('Skoda', 'Octavia', webpage_name='autovia')['count'] == 1
+    assert market_stats.price_summary('Skoda')['count'] == 4
+
+
+def test_duplicate_urls_are_counted_once(db, add_ad):
+    with AdvertisementWriter() as writer:
+        add_ad(writer, 'https://www.autoscout24.com/offers/1', price=10000)
+    with AdvertisementWriter() as writer:
+        add_ad(writer, 'https://www.autoscout24.com/offers/1', price=20000)
+    summary = market_stats.price_summary('Skoda')
+    assert (summary['count'], summary['max']) == (1, 10000)
+
+
+def test_update_existing_moves_price_stats(db, add_ad):
+    with AdvertisementWriter() as writer:
+        add_ad(writer, 'https://www.autoscout24.com/offers/1', price=10000)
+        add_ad(writer, 'https://www.autoscout24.com/offers/2', price=15000)
+    with AdvertisementWriter(update_existing=True) as writer:
+        add_ad(writer, 'https://www.autoscout24.com/offers/2', price=12000)
+        add_ad(writer, 'https://www.autoscout24.com/offers/1', year='2016')
+    stats = {group['year']: group for group in market_stats.group_stats('Skoda')}
+    assert (stats[2015]['count'], stats[2015]['min'], stats[2015]['max']) == (1, 12000, 12000)
+    assert (stats[2016]['count'], stats[2016]['min'], stats[2016]['max']) == (1, 10000, 10000)
+
+
+def test_rebuild_matches_incremental_summary(db, add_ad):
+    with AdvertisementWriter() as writer:
+        for i, price in enumerate((8000, 9500, 12000, 30000)):
+            add_ad(writer, f'https://www.autoscout24.com/offers/{i}', price=price, year=str(2014 + i % 2))
+        add_ad(writer, 'https://www.autovia.sk/1', site='autovia', price=11000)
+    with AdvertisementWriter(update_existing=True) as writer:
+        add_ad(writer, 'https://www.autoscout24.com/offers/3', price=10000, year='2015')
+    incremental = _summary_tables()
+    market_stats.rebuild(chunk_size=2)
+    assert _summary_tables() == incremental
@@ -0,0 +1,60 @@
+import threading
+
+from sqlalchemy.exc import OperationalError
+
+import market_stats
+import project_db
+from project_db import AdvertisementWriter
+
+
+def test_concurrent_writers_register_hooks_once(db, add_ad, monkeypatch):
+    monkeypatch.setattr(AdvertisementWriter, 'insert_hooks', [])
+    monkeypatch.setattr(AdvertisementWriter, 'update_hooks', [])
+    monkeypatch.setattr(project_db, '_hooks_loaded', False)
+    barrier = threading.Barrier(8)
+    writers = []
+
+    def build():
+        barrier.wait()
+        writers.append(AdvertisementWriter())
+
+    threads = [threading.Thread(target=build) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(AdvertisementWriter.insert_hooks) == 2
+    assert len(AdvertisementWriter.update_hooks) == 2
+    with writers[0] as writer:
+        add_ad(writer, 'https://www.autoscout24.com/offers/1')
+    assert market_stats.price_summary('Skoda')['count'] == 1
+
+
+def test_bad_row_is_dropped_alone(db, add_ad):
+    writer = AdvertisementWriter(batch_size=6)
+    add_ad(writer, 'https://www.autoscout24.com/offers/bad', brand=None)
+    for i in range(5):
+        add_ad(writer, f'https://www.autoscout24.com/offers/{i}')
+    assert writer.close() == (5, 0)
+    assert writer.failed == 1
+    assert market_stats.price_summary('Skoda')['count'] == 5
+
+
+def test_locked_database_keeps_batch_for_limited_attempts(db, add_ad, monkeypatch):
+    writer = AdvertisementWriter(batch_size=100)
+    add_ad(writer, 'https://www.autoscout24.com/offers/1')
+    calls = []
+
+    def locked(rows, sources):
+        calls.append(len(rows))
+        raise OperationalError('INSERT', {}, Exception('database is locked'))
+
+    monkeypatch.setattr(writer, '_insert', locked)
+    assert writer.flush() == (0, 0)
+    assert len(writer._buffer) == 1
+    writer.close()
+    assert calls == [1] * project_db.MAX_WRITE_ATTEMPTS
+    assert writer._buffer == []
+    assert writer.failed == 1
+
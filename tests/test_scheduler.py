@@ -0,0 +1,25 @@
+import pytest
+
+pytest.importorskip('selenium')
+
+from scheduler import SiteConfig, allocate_workers  # noqa: E402
+
+
+def _sites(**max_workers):
+    return {name: SiteConfig(object, f'https://{name}', max_workers=cap) for name, cap in max_workers.items()}
+
+
+def test_budget_follows_new_listings():
+    sites = _sites(a=4, b=4)
+    assert allocate_workers(4, sites, {'a': 90, 'b': 10}) == {'a': 3, 'b': 1}
+
+
+def test_site_caps_are_respected():
+    sites = _sites(a=2, b=1)
+    assert allocate_workers(10, sites, {'a': 100, 'b': 100}) == {'a': 2, 'b': 1}
+
+
+def test_small_budget_leaves_out_quiet_sites():
+    sites = _sites(a=4, b=4, c=4)
+    assert allocate_workers(2, sites, {'b': 5, 'c': 50}) == {'c': 1, 'b': 1}
+    assert allocate_workers(0, sites, {}) == {}
@@ -0,0 +1,35 @@
+import os
+import socket
+import subprocess
+import sys
+
+from session_manager import BrowserSession
+
+
+def _lock(session, pid, host=None):
+    os.symlink(f'{host or socket.gethostname()}-{pid}', os.path.join(session.profile_dir, 'SingletonLock'))
+    open(os.path.join(session.profile_dir, 'SingletonCookie'), 'w').close()
+
+
+def test_lock_of_dead_browser_is_removed(tmp_path):
+    session = BrowserSession(str(tmp_path))
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    _lock(session, process.pid)
+    assert session.chrome_arguments() == [f'--user-data-dir={session.profile_dir}']
+    assert os.listdir(session.profile_dir) == []
+
+
+def test_profile_of_running_browser_is_left_alone(tmp_path):
+    session = BrowserSession(str(tmp_path))
+    _lock(session, os.getpid())
+    arguments = session.chrome_arguments()
+    assert arguments != [f'--user-data-dir={session.profile_dir}']
+    assert sorted(os.listdir(session.profile_dir)) == ['SingletonCookie', 'SingletonLock']
+
+
+def test_lock_from_other_host_is_left_alone(tmp_path):
+    session = BrowserSession(str(tmp_path))
+    _lock(session, 1, host='elsewhere')
+    assert session.chrome_arguments() != [f'--user-data-dir={session.profile_dir}']
+    assert os.path.lexists(os.path.join(session.profile_dir, 'SingletonLock'))
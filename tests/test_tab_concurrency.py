@@ -0,0 +1,31 @@
+from rate_limit import RateLimiter
+from tab_concurrency import TabController
+
+
+def test_fast_batches_add_tabs_up_to_maximum():
+    controller = TabController(initial=2, maximum=4)
+    sizes = [controller.update(pages=controller.size, failures=0, seconds=controller.size) for _ in range(4)]
+    assert sizes == [3, 4, 4, 4]
+
+
+def test_congestion_halves_tabs():
+    controller = TabController(initial=8, minimum=2)
+    controller.update(pages=8, failures=0, seconds=8)
+    assert controller.update(pages=9, failures=3, seconds=9) == 4
+    assert controller.update(pages=4, failures=0, seconds=20) == 2
+    assert controller.update(pages=2, failures=0, seconds=2, memory_pressure=True) == 2
+    assert controller.decreases == 2
+
+
+def test_rate_limiter_burst_caps_tabs():
+    controller = TabController(initial=10, maximum=20, rate_limiter=RateLimiter(1.0, burst=3))
+    assert controller.size == 3
+    assert controller.update(pages=3, failures=0, seconds=3) == 3
+
+
+def test_fixed_size_never_changes():
+    controller = TabController.fixed(4)
+    controller.update(pages=4, failures=4, seconds=100)
+    controller.update(pages=4, failures=0, seconds=1)
+    assert controller.size == 4
+    assert [len(batch) for batch in controller.batches(range(10))] == [4, 4, 2]
@@ -0,0 +1,67 @@
+import hashlib
+import math
+from typing import Iterable, Iterator
+
+import project_db
+
+
+class BloomFilter:
+    """Compact probabilistic set, may report false positives but never false negatives"""
+
+    def __init__(self, capacity: int, error_rate: float = 0.001):
+        capacity = max(capacity, 1)
+        self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item: str):
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        for i in range(self.hash_count):
+            yield (h1 + i * h2) % self.size
+
+    def add(self, item: str) -> None:
+        for pos in self._positions(item):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(item))
+
+
+class SeenUrlIndex:
+    """In-memory index of advertisement urls already stored in the db.
+
+    With ``bloom=True`` urls are kept in a Bloom filter instead of a set, which
+    uses a fraction of the memory on large tables at the cost of rarely
+    skipping an unseen url.
+    """
+
+    def __init__(self, urls: Iterable[str] = (), bloom: bool = False, capacity: int = 1_000_000,
+                 error_rate: float = 0.001):
+        self._urls = BloomFilter(capacity, error_rate) if bloom else set()
+        for url in urls:
+            self.add(url)
+
+    @classmethod
+    def load(cls, bloom: bool = False, error_rate: float = 0.001) -> 'SeenUrlIndex':
+        capacity = max(project_db.count_advertisements() * 2, 100_000) if bloom else 0
+        return cls(project_db.iter_advertisement_urls(), bloom=bloom, capacity=capacity,
+                   error_rate=error_rate)
+
+    def add(self, url: str) -> None:
+        self._urls.add(url)
+
+    def __contains__(self, url: str) -> bool:
+        return url in self._urls
+
+    def filter_iter(self, links: Iterable[str]) -> Iterator[str]:
+        """Yields links not in the index, preserving order and dropping repeats"""
+        for link in links:
+            if link in self:
+                continue
+            self.add(link)
+            yield link
+
+    def filter_new(self, links: Iterable[str]) -> list:
+        return list(self.filter_iter(links))